@@ -4,20 +4,36 @@ Einstein360 LMS - Python Flask Backend
 Connects to Google Sheets for data storage (same as original Code.gs)
 """
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, Response, stream_with_context, g
 from flask_cors import CORS
-from datetime import datetime
+from datetime import datetime, timedelta
 import uuid
 import os
+import bisect
+import threading
+import time
 import base64
+import click
 import io
+import itertools
 import csv
+import functools
+import gzip
+import hashlib
+import json
+import marshal
+import mmap
+import queue
 import re
-import gspread
-from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload
-from googleapiclient.errors import HttpError
+import struct
+import sys
+from array import array
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# gspread, google-auth, googleapiclient and numpy are imported on first use
+# (get_sheets_client, get_drive_service, the report engine) so the module imports in
+# milliseconds and forked workers don't pay for clients they may never touch.
 
 app = Flask(__name__)
 CORS(app)
@@ -36,13 +52,37 @@ SHEET_STRUCTURE = {
     'Trainees': ['Trainee ID', 'Batch Code', 'Name', 'Mobile', 'Email', 'Timestamp'],
     'Attendance': ['Record ID', 'Batch Code', 'Trainee ID', 'Date', 'Status', 'Timestamp'],
     'Questions': ['Module ID', 'Module Name', 'Question Text'],
-    'Results': ['Result ID', 'Trainee ID', 'Trainee Name', 'Module Number', 'Video Link', 'Audio Link', 'Attempt Count', 'Score', 'Timestamp']
+    'Results': ['Result ID', 'Trainee ID', 'Trainee Name', 'Module Number', 'Video Link', 'Audio Link', 'Attempt Count', 'Score', 'Timestamp'],
+    'Partitions': ['Partition', 'Sheet', 'Start Date', 'End Date', 'Rows', 'Timestamp'],
+    'Shards': ['Batch Code', 'Shard', 'Timestamp']
 }
 
+# Sharding: SPREADSHEET_ID is the catalog (Users, Questions, the Shards map) and also shard
+# 'main'. SHARD_SPREADSHEETS="s1=<id>,s2=<id>" adds more spreadsheets, each holding its own
+# Batches/Trainees/Attendance/Results (+ archives); a batch and everything under it live on
+# one shard. Unset, everything stays in SPREADSHEET_ID exactly as before.
+MAIN_SHARD = 'main'
+CATALOG_SHEETS = ('Users', 'Questions', 'Shards')
+SHARDED_SHEETS = ('Batches', 'Trainees', 'Attendance', 'Results', 'Partitions')
+
+def _parse_shards(value):
+    shards = {MAIN_SHARD: SPREADSHEET_ID}
+    for item in (value or '').split(','):
+        name, sep, spreadsheet_id = item.strip().partition('=')
+        if sep and name.strip() and spreadsheet_id.strip():
+            shards[name.strip()] = spreadsheet_id.strip()
+    return shards
+
+SHARD_SPREADSHEETS = _parse_shards(os.environ.get("SHARD_SPREADSHEETS"))
+# 'batch': new batches go to the shard with the fewest batches; 'trainer': all of a
+# trainer's batches go to the same shard (hash of the trainer ID).
+SHARD_BY = os.environ.get("SHARD_BY", "batch")
+
 # Global clients
 gc = None
 spreadsheet = None
 drive_service = None
+_shard_spreadsheets = {}  # shard name -> opened spreadsheet (other than main)
 
 # Google Drive folder ID for uploads (set your folder ID here or via env var)
 # NOTE: People often paste it as "<FOLDER_ID>" or as a full Drive URL; we normalize that.
@@ -72,15 +112,21 @@ DRIVE_UPLOAD_FOLDER_ID = (
 )
 DRIVE_FOLDER_NAME = "LMS_Uploads"
 
-def get_sheets_client():
+def get_sheets_client(shard=MAIN_SHARD):
     """Initialize Google Sheets client with service account.
 
     Important: if a previous init partially succeeded (e.g. authorized but couldn't open the sheet),
     `gc` may be set while `spreadsheet` is still None. So we re-init when either is missing.
+    Any other shard's spreadsheet is opened with the same client on first use.
     """
     global gc, spreadsheet
 
     if gc is None or spreadsheet is None:
+        import gspread
+        from google.oauth2.service_account import Credentials
+
+        _worksheets.clear()
+        _shard_spreadsheets.clear()
         try:
             base_dir = os.path.dirname(os.path.abspath(__file__))
             creds_path = os.path.join(base_dir, 'credentials.json')
@@ -105,18 +151,38 @@ def get_sheets_client():
                 f"Original error: {e}"
             )
 
-    return spreadsheet
+    if shard == MAIN_SHARD:
+        return spreadsheet
+    ss = _shard_spreadsheets.get(shard)
+    if ss is None:
+        try:
+            ss = _shard_spreadsheets[shard] = gc.open_by_key(SHARD_SPREADSHEETS[shard])
+        except KeyError:
+            raise Exception(f"Unknown shard: {shard}")
+        except Exception as e:
+            raise Exception(f"Could not open spreadsheet for shard {shard} "
+                            f"(is it shared with the service account?): {e}")
+    return ss
 
 def get_drive_service():
     """Initialize Google Drive service for file uploads"""
     global drive_service
     
     if drive_service is None:
+        from google.oauth2.service_account import Credentials
+
         try:
             base_dir = os.path.dirname(os.path.abspath(__file__))
             creds_path = os.path.join(base_dir, 'credentials.json')
             creds = Credentials.from_service_account_file(creds_path, scopes=SCOPES)
-            drive_service = build('drive', 'v3', credentials=creds)
+            from googleapiclient.discovery import build
+
+            # static_discovery: use the Drive v3 discovery document bundled with
+            # google-api-python-client instead of fetching it over the network.
+            drive_service = build(
+                'drive', 'v3', credentials=creds,
+                static_discovery=True, cache_discovery=False,
+            )
         except Exception as e:
             print(f"Drive service init error: {e}")
             raise Exception(f"Google Drive connection failed: {e}")
@@ -153,6 +219,8 @@ def get_or_create_drive_folder() -> str:
     - If DRIVE_UPLOAD_FOLDER_ID is set, we use it.
     - Otherwise we create/use a folder named DRIVE_FOLDER_NAME in the service account's Drive.
     """
+    from googleapiclient.errors import HttpError
+
     if DRIVE_UPLOAD_FOLDER_ID:
         folder_id = DRIVE_UPLOAD_FOLDER_ID
         try:
@@ -206,11 +274,57 @@ def get_or_create_drive_folder() -> str:
         raise Exception(f"Failed to get/create Drive folder: {e}")
 
 
+# sha256 of uploaded media -> Drive link, so a retried or repeated upload of the same
+# bytes reuses the file instead of sending it again. Uploads also carry the hash as an
+# appProperty, which lets other workers (and restarts) find them with one files.list.
+UPLOAD_HASH_CHUNK = 1024 * 1024
+DRIVE_UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024  # read from the stream per request (multiple of 256 KiB)
+UPLOAD_LINK_CACHE_SIZE = 1000
+_upload_links = OrderedDict()
+_upload_links_lock = threading.Lock()
+
+
+def _sha256_stream(stream):
+    """Hex sha256 of a binary stream, read UPLOAD_HASH_CHUNK bytes at a time, then rewound."""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(UPLOAD_HASH_CHUNK), b''):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+def _remember_upload(sha256, link):
+    with _upload_links_lock:
+        _upload_links[sha256] = link
+        _upload_links.move_to_end(sha256)
+        while len(_upload_links) > UPLOAD_LINK_CACHE_SIZE:
+            _upload_links.popitem(last=False)
+
+
+def _find_uploaded(service, folder_id, sha256):
+    """Share link of a file already uploaded with this content hash, or None."""
+    with _upload_links_lock:
+        link = _upload_links.get(sha256)
+    if link:
+        return link
+    found = service.files().list(
+        q=(f"appProperties has {{ key='sha256' and value='{sha256}' }} "
+           f"and '{folder_id}' in parents and trashed=false"),
+        fields="files(id, webViewLink, webContentLink)",
+        pageSize=1,
+        includeItemsFromAllDrives=True,
+        supportsAllDrives=True,
+    ).execute().get("files", [])
+    if not found:
+        return None
+    link = found[0].get("webViewLink") or found[0].get("webContentLink")
+    if link:
+        _remember_upload(sha256, link)
+    return link
+
+
 def upload_to_drive(base64_data: str, filename: str, mime_type: str) -> str:
     """Upload a base64 file to Google Drive and return a public webViewLink."""
-    service = get_drive_service()
-    folder_id = get_or_create_drive_folder()
-
     raw_b64 = _fix_base64_padding(_strip_data_url_base64(base64_data))
 
     try:
@@ -218,14 +332,41 @@ def upload_to_drive(base64_data: str, filename: str, mime_type: str) -> str:
     except Exception as e:
         raise Exception(f"Invalid base64 data: {e}")
 
+    return upload_stream_to_drive(io.BytesIO(file_data), filename, mime_type)
+
+
+def upload_stream_to_drive(stream, filename: str, mime_type: str) -> str:
+    """Upload a seekable binary stream to Google Drive and return a public webViewLink.
+
+    If a file with the same content (sha256) was uploaded before, its link is returned
+    and nothing is sent.
+    """
+    from googleapiclient.errors import HttpError
+    from googleapiclient.http import MediaIoBaseUpload
+
+    service = get_drive_service()
+    folder_id = get_or_create_drive_folder()
+
+    sha256 = _sha256_stream(stream)
+    try:
+        link = _find_uploaded(service, folder_id, sha256)
+    except HttpError as e:
+        print(f"Drive duplicate lookup failed, uploading anyway: {e}")
+        link = None
+    if link:
+        print(f"Reusing Drive upload with the same content for {filename}")
+        return link
+
     safe_name = _safe_filename(filename)
 
     file_metadata = {
         "name": safe_name,
         "parents": [folder_id],
+        "appProperties": {"sha256": sha256},
     }
 
-    media = MediaIoBaseUpload(io.BytesIO(file_data), mimetype=mime_type, resumable=True)
+    media = MediaIoBaseUpload(stream, mimetype=mime_type, chunksize=DRIVE_UPLOAD_CHUNK_BYTES,
+                              resumable=True)
 
     try:
         created = service.files().create(
@@ -267,37 +408,1987 @@ def upload_to_drive(base64_data: str, filename: str, mime_type: str) -> str:
     if not link:
         raise Exception("Drive upload succeeded but no share link was returned")
 
+    _remember_upload(sha256, link)
     return link
 
+# Worksheet handles, filled by check_database() so get_sheet() normally makes no API call.
+_worksheets = {}
+_worksheets_lock = threading.RLock()
+
+def sheet_key(shard, sheet_name):
+    """Name a sheet on a shard is known by (cache, versions): 'Results' on main, 's2/Results' elsewhere."""
+    return sheet_name if shard == MAIN_SHARD else f"{shard}/{sheet_name}"
+
+def split_key(key):
+    """'s2/Results' -> ('s2', 'Results'); 'Results' -> ('main', 'Results')."""
+    shard, sep, sheet_name = key.partition('/')
+    return (shard, sheet_name) if sep else (MAIN_SHARD, key)
+
+def shard_sheets(shard):
+    """Sheets check_database() keeps on a shard's spreadsheet."""
+    return list(SHEET_STRUCTURE) if shard == MAIN_SHARD else list(SHARDED_SHEETS)
+
+def _worksheet_from_properties(ss, properties):
+    import gspread
+    return gspread.Worksheet(ss.id, ss.client, properties)
+
+def _header_fetch_params(titles):
+    return {
+        'includeGridData': 'true',
+        'ranges': [f"'{title}'!1:1" for title in titles],
+        'fields': 'sheets(properties,data(rowData(values(formattedValue))))',
+    }
+
 def get_sheet(sheet_name):
-    """Get a specific sheet, create if not exists (like checkDatabase in Code.gs)"""
-    ss = get_sheets_client()
-    try:
-        sheet = ss.worksheet(sheet_name)
-        # Check if header exists
-        if sheet.row_count == 0 or not sheet.row_values(1):
-            if sheet_name in SHEET_STRUCTURE:
-                sheet.append_row(SHEET_STRUCTURE[sheet_name])
-    except gspread.WorksheetNotFound:
-        sheet = ss.add_worksheet(title=sheet_name, rows=1000, cols=20)
-        if sheet_name in SHEET_STRUCTURE:
-            sheet.append_row(SHEET_STRUCTURE[sheet_name])
-    return sheet
-
-def check_database():
-    """Ensure all sheets exist with headers (same as checkDatabase in Code.gs)"""
-    ss = get_sheets_client()
-    for sheet_name, headers in SHEET_STRUCTURE.items():
+    """Get a specific sheet, create if not exists (like checkDatabase in Code.gs).
+
+    `sheet_name` may be a shard key such as 's2/Results' (see sheet_key()).
+    """
+    sheet = _worksheets.get(sheet_name)
+    if sheet is not None:
+        return sheet
+
+    with _worksheets_lock:
+        if sheet_name not in _worksheets:
+            shard, title = split_key(sheet_name)
+            if title in shard_sheets(shard):
+                check_database(shard)
+            else:
+                import gspread
+
+                ss = get_sheets_client(shard)
+                try:
+                    _worksheets[sheet_name] = ss.worksheet(title)
+                except gspread.WorksheetNotFound:
+                    _worksheets[sheet_name] = ss.add_worksheet(title=title, rows=1000, cols=20)
+        return _worksheets[sheet_name]
+
+def check_database(shard=MAIN_SHARD):
+    """Ensure all sheets exist with headers (same as checkDatabase in Code.gs).
+
+    One spreadsheets.get returns every sheet's properties plus its header row; anything
+    missing is created in a single batchUpdate. If a sheet doesn't exist the ranged read is
+    rejected, so we fall back to a metadata-only call plus one header read.
+    """
+    import gspread
+
+    ss = get_sheets_client(shard)
+    structure = {name: SHEET_STRUCTURE[name] for name in shard_sheets(shard)}
+    with _worksheets_lock:
         try:
-            sheet = ss.worksheet(sheet_name)
-            if sheet.row_count == 0 or not sheet.row_values(1):
-                sheet.append_row(headers)
-        except gspread.WorksheetNotFound:
-            sheet = ss.add_worksheet(title=sheet_name, rows=1000, cols=20)
-            sheet.append_row(headers)
+            sheets = ss.fetch_sheet_metadata(params=_header_fetch_params(structure))['sheets']
+        except gspread.exceptions.APIError:
+            meta = ss.fetch_sheet_metadata(params={'fields': 'sheets.properties'})
+            titles = [s['properties']['title'] for s in meta['sheets']]
+            existing = [t for t in structure if t in titles]
+            sheets = ss.fetch_sheet_metadata(params=_header_fetch_params(existing))['sheets'] if existing else []
+            sheets += [s for s in meta['sheets'] if s['properties']['title'] not in existing]
+
+        found = {}
+        for s in sheets:
+            props = s['properties']
+            row = (s.get('data') or [{}])[0].get('rowData') or [{}]
+            header = [v.get('formattedValue', '') for v in row[0].get('values', [])]
+            found[props['title']] = (props, any(header))
+
+        requests = []
+        created = {}
+        next_id = max([p['sheetId'] for p, _ in found.values()] + [0]) + 1
+        for sheet_name, headers in structure.items():
+            if sheet_name in found:
+                props, has_header = found[sheet_name]
+            else:
+                props = {'title': sheet_name, 'sheetId': next_id,
+                         'gridProperties': {'rowCount': 1000, 'columnCount': 20}}
+                next_id += 1
+                requests.append({'addSheet': {'properties': props}})
+                created[sheet_name] = props
+                has_header = False
+            if not has_header:
+                requests.append({'updateCells': {
+                    'start': {'sheetId': props['sheetId'], 'rowIndex': 0, 'columnIndex': 0},
+                    'rows': [{'values': [{'userEnteredValue': {'stringValue': h}} for h in headers]}],
+                    'fields': 'userEnteredValue',
+                }})
+
+        if requests:
+            replies = ss.batch_update({'requests': requests}).get('replies', [])
+            for reply in replies:
+                if 'addSheet' in reply:
+                    props = reply['addSheet']['properties']
+                    created[props['title']] = props
+
+        for sheet_name in structure:
+            props = created.get(sheet_name) or found[sheet_name][0]
+            _worksheets[sheet_key(shard, sheet_name)] = _worksheet_from_properties(ss, props)
+
+# IDs are ULIDs: a 48-bit millisecond timestamp followed by 80 random bits, in Crockford
+# base32, so they sort in creation order. IDs created before this (8 hex chars) are still
+# valid everywhere; they just carry no time.
+_CROCKFORD32 = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+_ULID_RE = re.compile(r"^[0-9A-HJKMNP-TV-Z]{26}$")
+_ulid_lock = threading.Lock()
+_ulid_last = (0, 0)  # (ms, random part) of the previous ULID
+
+def new_ulid():
+    """Monotonic ULID: within one millisecond the random part is incremented, not redrawn."""
+    global _ulid_last
+    with _ulid_lock:
+        ms = int(time.time() * 1000)
+        last_ms, last_rand = _ulid_last
+        if ms <= last_ms:
+            # Same millisecond (or the clock stepped back): stay ordered after the last ID.
+            ms, rand = last_ms, last_rand + 1
+            if rand >> 80:
+                ms, rand = ms + 1, 0
+        else:
+            rand = int.from_bytes(os.urandom(10), 'big')
+        _ulid_last = (ms, rand)
+    value = (ms << 80) | rand
+    return ''.join(_CROCKFORD32[(value >> shift) & 31] for shift in range(125, -1, -5))
+
+def ulid_ms(record_id):
+    """Creation time (epoch ms) of a ULID-based ID such as 'RES-01J...', or None for legacy IDs."""
+    value = (record_id or '')[-26:]
+    if not _ULID_RE.match(value) or (len(record_id) > 26 and record_id[-27] != '-'):
+        return None
+    n = 0
+    for ch in value:
+        n = n * 32 + _CROCKFORD32.index(ch)
+    return n >> 80
 
 def generate_id(prefix=''):
-    return f"{prefix}{uuid.uuid4().hex[:8]}"
+    return f"{prefix}{new_ulid()}"
+
+# ==================== TABLE VERSIONS ====================
+# Every write path bumps the version of the sheet it touched, so in-memory caches can
+# tell whether what they computed is still current without re-reading Google Sheets.
+
+_table_versions = {name: 0 for name in SHEET_STRUCTURE}
+_table_versions_lock = threading.Lock()
+
+def mark_table_changed(*sheet_names):
+    with _table_versions_lock:
+        for name in sheet_names:
+            _table_versions[name] = _table_versions.get(name, 0) + 1
+
+def table_versions(*sheet_names):
+    with _table_versions_lock:
+        return tuple(_table_versions.get(name, 0) for name in sheet_names)
+
+# ==================== SHEET CACHE ====================
+# Worksheet values are cached in memory and persisted to a local snapshot file so restarts
+# and new workers start warm. An entry is served while (a) nothing was written to that sheet
+# through this process and (b) the spreadsheet's Drive `version` (bumped by every edit,
+# including hand edits in Google Sheets) still matches the version seen before it was loaded.
+
+SHEET_CACHE_CHECK_SECONDS = float(os.environ.get("SHEET_CACHE_CHECK_SECONDS", "10"))
+# Longest an append-only sheet is served from tail-syncs alone before the next refresh
+# re-reads it in full (which is what picks up hand edits to older rows).
+SHEET_FULL_RELOAD_SECONDS = float(os.environ.get("SHEET_FULL_RELOAD_SECONDS", "900"))
+SNAPSHOT_PATH = os.environ.get("SHEETS_SNAPSHOT_PATH") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '.cache', 'sheets.snap'
+)
+SNAPSHOT_WRITE_DELAY = 5  # seconds; coalesces bursts of reloads into one file write
+# Never written to disk: Users holds passwords.
+SNAPSHOT_EXCLUDED_SHEETS = {'Users'}
+
+# File layout: magic, u32 header length, JSON header, then one marshal blob per table.
+# marshal is Python-version specific, so the header records the ABI and a mismatch just
+# means a cold start.
+_SNAPSHOT_MAGIC = b'E360SNP1'
+_SNAPSHOT_ABI = f"{sys.implementation.name}-{sys.version_info[0]}.{sys.version_info[1]}-marshal{marshal.version}"
+
+
+def _col_letter(n):
+    """1 -> A, 27 -> AA"""
+    letters = ''
+    while n:
+        n, rem = divmod(n - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+# Sheets the app only ever appends to, with the 1-based columns it later updates in place
+# (Results column H = Score). Refreshing these fetches only the rows past what is cached,
+# plus a narrow read of the mutable columns, instead of the whole sheet.
+APPEND_ONLY_SHEETS = {
+    'Attendance': (),
+    'Trainees': (),
+    'Results': (8,),
+}
+
+_cache_generations = itertools.count(1)
+
+
+def fetch_spreadsheet_version(spreadsheet_id=SPREADSHEET_ID):
+    """Drive's file version for a spreadsheet (one small files.get call).
+
+    Sent through gspread's requests session, which the Sheets reads already share across
+    threads; the httplib2-based Drive client from get_drive_service() is not thread-safe.
+    """
+    from gspread.urls import DRIVE_FILES_API_V3_URL
+
+    response = get_sheets_client().client.request(
+        'get', f"{DRIVE_FILES_API_V3_URL}/{spreadsheet_id}",
+        params={'fields': 'version', 'supportsAllDrives': True},
+    )
+    return response.json().get('version')
+
+
+class _CachedTable:
+    """One sheet's values. The rows are never mutated after creation; `index` is filled in
+    on first use and the version stamps are refreshed when a reload finds nothing changed.
+
+    A tail-synced entry records what it was derived from (`base_generation`, the row count
+    it appended after, and whether any existing row was patched) so consumers such as the
+    attendance store can apply just the new rows. `verified_at` is the wall-clock time the
+    rows were last read in full; it survives tail-syncs and the snapshot.
+    """
+
+    __slots__ = ('rows', 'index', 'local_version', 'remote_version', 'loaded_at', 'verified_at',
+                 'generation', 'base_generation', 'appended_from', 'patched')
+
+    def __init__(self, rows, local_version, remote_version, index=None, verified_at=None):
+        self.rows = rows
+        self.index = index
+        self.local_version = local_version
+        self.remote_version = remote_version
+        self.loaded_at = time.monotonic()
+        self.verified_at = time.time() if verified_at is None else verified_at
+        self.generation = next(_cache_generations)
+        self.base_generation = None
+        self.appended_from = None
+        self.patched = False
+
+
+class _Snapshot:
+    """Read side of the snapshot file: mmapped once, each table decoded on first use.
+
+    The mapping is opened at import, so with `gunicorn --preload` every forked worker
+    shares the same page-cache pages.
+    """
+
+    def __init__(self, path):
+        self.tables = {}
+        self._mm = None
+        try:
+            with open(path, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):  # missing or empty file
+            return
+        try:
+            if mm[:len(_SNAPSHOT_MAGIC)] != _SNAPSHOT_MAGIC:
+                raise ValueError('bad magic')
+            (header_len,) = struct.unpack_from('<I', mm, len(_SNAPSHOT_MAGIC))
+            start = len(_SNAPSHOT_MAGIC) + 4
+            header = json.loads(mm[start:start + header_len])
+            if header.get('abi') != _SNAPSHOT_ABI or header.get('spreadsheetId') != SPREADSHEET_ID:
+                raise ValueError('snapshot from another spreadsheet or Python version')
+        except Exception as e:
+            print(f"Ignoring sheet snapshot {path}: {e}")
+            mm.close()
+            return
+        self._mm = mm
+        self._data_start = start + header_len
+        self.tables = header['tables']
+
+    def load(self, name):
+        """Return (rows, index, remote_version, verified_at) for a table, or None."""
+        meta = self.tables.get(name)
+        if meta is None or self._mm is None:
+            return None
+        offset = self._data_start + meta['offset']
+        try:
+            rows, index = marshal.loads(self._mm[offset:offset + meta['length']])
+        except (EOFError, ValueError, TypeError) as e:
+            print(f"Ignoring damaged snapshot table {name}: {e}")
+            return None
+        # Snapshots written before verifiedAt existed get a full reload on their next refresh.
+        return rows, index, meta['remoteVersion'], meta.get('verifiedAt', 0)
+
+
+def write_snapshot(path, tables):
+    """Atomically write {name: _CachedTable} to `path`."""
+    blobs = []
+    header = {'abi': _SNAPSHOT_ABI, 'spreadsheetId': SPREADSHEET_ID, 'tables': {}}
+    offset = 0
+    for name, entry in tables.items():
+        blob = marshal.dumps((entry.rows, entry.index))
+        header['tables'][name] = {'offset': offset, 'length': len(blob), 'remoteVersion': entry.remote_version,
+                                  'verifiedAt': entry.verified_at}
+        blobs.append(blob)
+        offset += len(blob)
+    header_bytes = json.dumps(header).encode('utf-8')
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(_SNAPSHOT_MAGIC)
+        f.write(struct.pack('<I', len(header_bytes)))
+        f.write(header_bytes)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp_path, path)
+
+
+def _first_column_index(rows):
+    index = {}
+    for i, row in enumerate(rows[1:], start=2):
+        if row and row[0]:
+            index.setdefault(row[0], i)
+    return index
+
+
+class SheetCache:
+    def __init__(self, snapshot_path=SNAPSHOT_PATH):
+        self._lock = threading.Lock()
+        self._table_locks = {}
+        self._tables = {}
+        self._remote = {}  # spreadsheet ID -> (version, monotonic time checked)
+        self._remote_locks = {}
+        self._snapshot_path = snapshot_path
+        self._snapshot = _Snapshot(snapshot_path) if snapshot_path else None
+        self._snapshot_timer = None
+
+    def _table_lock(self, name):
+        with self._lock:
+            return self._table_locks.setdefault(name, threading.Lock())
+
+    def remote_version(self, spreadsheet_id=SPREADSHEET_ID):
+        """Spreadsheet version, re-checked at most every SHEET_CACHE_CHECK_SECONDS.
+
+        Each shard is its own file, so an edit on one shard never reloads another's tables.
+        Single-flight: threads arriving while a check is in progress wait for its result.
+        """
+        stale = lambda checked_at: checked_at is None or time.monotonic() - checked_at > SHEET_CACHE_CHECK_SECONDS
+        version, checked_at = self._remote.get(spreadsheet_id, (None, None))
+        if stale(checked_at):
+            with self._lock:
+                lock = self._remote_locks.setdefault(spreadsheet_id, threading.Lock())
+            with lock:
+                version, checked_at = self._remote.get(spreadsheet_id, (None, None))
+                if stale(checked_at):
+                    try:
+                        version = fetch_spreadsheet_version(spreadsheet_id)
+                    except Exception as e:
+                        print(f"Spreadsheet version check failed: {e}")
+                        version = None
+                    self._remote[spreadsheet_id] = (version, time.monotonic())
+        return version
+
+    def _is_fresh(self, name, entry, remote, expected_rows=None):
+        if entry is None or entry.local_version != table_versions(name)[0]:
+            return False
+        if expected_rows is not None:
+            # Archive partitions only grow, and the Partitions manifest says by how much.
+            return len(entry.rows) - 1 == expected_rows
+        if remote is None:
+            # Can't ask Drive: fall back to a plain time-to-live.
+            return time.monotonic() - entry.loaded_at <= SHEET_CACHE_CHECK_SECONDS
+        return entry.remote_version == remote
+
+    def _from_snapshot(self, name):
+        loaded = self._snapshot.load(name) if self._snapshot else None
+        if loaded is None:
+            return None
+        rows, index, remote_version, verified_at = loaded
+        return _CachedTable(rows, table_versions(name)[0], remote_version, index, verified_at)
+
+    def entry(self, name, expected_rows=None):
+        """Current _CachedTable for a sheet; a new object whenever the data was reloaded.
+
+        `expected_rows` (data rows, header excluded) pins the entry to a row count instead
+        of the spreadsheet version; see list_partitions().
+        """
+        with self._table_lock(name):
+            entry = self._tables.get(name)
+            if entry is None:
+                entry = self._from_snapshot(name)
+            # The version is read before the values, so a concurrent edit can only make
+            # the entry look older than it is (an extra reload), never newer.
+            remote = self.remote_version(SHARD_SPREADSHEETS[split_key(name)[0]])
+            if not self._is_fresh(name, entry, remote, expected_rows):
+                local = table_versions(name)[0]
+                synced = self._tail_sync(name, entry, local, remote) if entry is not None else None
+                fresh = synced or _CachedTable(get_sheet(name).get_all_values(), local, remote)
+                if entry is not None and fresh.rows == entry.rows:
+                    # The edit was to another sheet: keep this entry (and its generation),
+                    # so everything derived from it stays valid.
+                    entry.local_version, entry.remote_version = local, remote
+                    entry.loaded_at, entry.verified_at = fresh.loaded_at, fresh.verified_at
+                else:
+                    entry = fresh
+                self._schedule_snapshot()
+            # save_snapshot() iterates _tables under _lock, so writes take it too.
+            with self._lock:
+                self._tables[name] = entry
+            return entry
+
+    def _tail_sync(self, name, old, local, remote):
+        """Refresh an append-only sheet from the rows past `old`; None means do a full reload.
+
+        The range starts at the last row we already hold, and that row must come back
+        unchanged. If rows were deleted, inserted or re-sorted by hand, it won't match and
+        we fall back to get_all_values(). Hand edits to other cells of older rows can't be
+        seen this way, so a full reload is also forced once `old` was last read in full more
+        than SHEET_FULL_RELOAD_SECONDS ago.
+        """
+        title = split_key(name)[1]
+        mutable_cols = APPEND_ONLY_SHEETS.get(title)
+        if mutable_cols is None and base_sheet(title) != title:
+            mutable_cols = ()  # archive partitions are append-only
+        if mutable_cols is None or len(old.rows) < 2:
+            return None
+        if time.time() - old.verified_at > SHEET_FULL_RELOAD_SECONDS:
+            return None
+        width = len(SHEET_STRUCTURE[base_sheet(title)])
+        n = len(old.rows)
+
+        ranges = [f"A{n}:{_col_letter(width)}"]
+        ranges += [f"{_col_letter(c)}2:{_col_letter(c)}{n}" for c in mutable_cols]
+        fetched = get_sheet(name).batch_get(ranges)
+
+        pad = lambda r: list(r) + [''] * (width - len(r))
+        fixed = lambda r: [v for c, v in enumerate(pad(r)[:width], start=1) if c not in mutable_cols]
+        tail = [pad(r) for r in fetched[0]]
+        while tail and not any(tail[-1]):
+            tail.pop()
+        if not tail or fixed(tail[0]) != fixed(old.rows[-1]):
+            return None
+
+        rows = list(old.rows)
+        patched = False
+        for col, values in zip(mutable_cols, fetched[1:]):
+            for i, value in enumerate(values, start=1):
+                value = value[0] if value else ''
+                row = rows[i]
+                if (row[col - 1] if len(row) >= col else '') != value:
+                    row = pad(row) if len(row) < width else list(row)
+                    row[col - 1] = value
+                    rows[i] = row
+                    patched = True
+            # Trailing empty cells aren't returned at all
+            for i in range(len(values) + 1, n):
+                row = rows[i]
+                if len(row) >= col and row[col - 1] != '':
+                    rows[i] = list(row)
+                    rows[i][col - 1] = ''
+                    patched = True
+        rows.extend(tail[1:])
+
+        index = None
+        if old.index is not None:
+            index = dict(old.index)
+            for i, row in enumerate(tail[1:], start=n + 1):
+                if row[0]:
+                    index.setdefault(row[0], i)
+
+        entry = _CachedTable(rows, local, remote, index, old.verified_at)
+        entry.base_generation = old.generation
+        entry.appended_from = n
+        entry.patched = patched
+        return entry
+
+    def holds(self, name):
+        """Whether this process already has the sheet in memory (fresh or not)."""
+        return name in self._tables
+
+    def rows(self, name):
+        """Cached equivalent of get_sheet(name).get_all_values(). Treat as read-only."""
+        return self.entry(name).rows
+
+    def index(self, name):
+        """{first-column value: sheet row number} for a sheet (first occurrence wins)."""
+        entry = self.entry(name)
+        if entry.index is None:
+            entry.index = _first_column_index(entry.rows)
+            self._schedule_snapshot()
+        return entry.index
+
+    def invalidate(self, name=None):
+        with self._lock:
+            if name is None:
+                self._tables.clear()
+            else:
+                self._tables.pop(name, None)
+
+    def _schedule_snapshot(self):
+        if not self._snapshot_path:
+            return
+        with self._lock:
+            if self._snapshot_timer is None:
+                self._snapshot_timer = threading.Timer(SNAPSHOT_WRITE_DELAY, self.save_snapshot)
+                self._snapshot_timer.daemon = True
+                self._snapshot_timer.start()
+
+    def save_snapshot(self):
+        with self._lock:
+            self._snapshot_timer = None
+            # Entries loaded while Drive was unreachable can't be verified on the next boot.
+            tables = {name: e for name, e in self._tables.items()
+                      if e.remote_version is not None and split_key(name)[1] not in SNAPSHOT_EXCLUDED_SHEETS}
+        if not tables:
+            return
+        try:
+            write_snapshot(self._snapshot_path, tables)
+        except Exception as e:
+            print(f"Could not write sheet snapshot: {e}")
+
+    def warm(self, names):
+        """Load (from the snapshot when still current) so the first requests don't pay for it."""
+        for name in names:
+            self.entry(name)
+
+
+sheet_cache = SheetCache()
+
+# ==================== SHARDS ====================
+# Routing for SHARD_SPREADSHEETS. The Shards sheet (catalog) maps batch code -> shard; a
+# batch that isn't listed lives on main, which is where every batch lived before sharding.
+# Writes go to the batch's shard (results: the shard holding the trainee). Reads that span
+# batches use table_rows()/table_entry(), which refresh every shard's cached copy in
+# parallel and concatenate them; each shard is version-checked on its own, so a write to
+# one shard only reloads that shard's tables.
+
+SHARD_FAN_OUT_WORKERS = 8
+_shard_pool = None
+_shard_pool_lock = threading.Lock()
+_merged_tables = {}  # sheet -> (shard entries, merged _CachedTable)
+_merged_tables_lock = threading.Lock()
+_shard_map = (None, {})  # (Shards cache entry, {batch code: shard})
+
+
+def shard_ids():
+    return list(SHARD_SPREADSHEETS)
+
+
+def shard_keys(sheet_name):
+    """Keys of every shard's copy of a sheet; just the sheet for catalog sheets or one shard."""
+    if sheet_name in CATALOG_SHEETS or len(SHARD_SPREADSHEETS) == 1:
+        return [sheet_name]
+    return [sheet_key(shard, sheet_name) for shard in SHARD_SPREADSHEETS]
+
+
+def fan_out(fn, items):
+    """[fn(item) for item in items], run concurrently when there is more than one item."""
+    global _shard_pool
+    items = list(items)
+    if len(items) < 2:
+        return [fn(item) for item in items]
+    with _shard_pool_lock:
+        if _shard_pool is None:
+            _shard_pool = ThreadPoolExecutor(SHARD_FAN_OUT_WORKERS, thread_name_prefix='shard')
+    return list(_shard_pool.map(fn, items))
+
+
+def table_entry(sheet_name):
+    """Cached table for a sheet across all shards (header once, then each shard's rows).
+
+    With one shard this is the sheet cache entry itself. Otherwise the merged entry, and
+    its generation, are reused until one of the shard entries is reloaded.
+    """
+    keys = shard_keys(sheet_name)
+    if len(keys) == 1:
+        return sheet_cache.entry(keys[0])
+    parts = fan_out(sheet_cache.entry, keys)
+    with _merged_tables_lock:
+        cached = _merged_tables.get(sheet_name)
+        if cached is not None and all(a is b for a, b in zip(cached[0], parts)):
+            return cached[1]
+        rows = parts[0].rows[:1] + [row for part in parts for row in part.rows[1:]]
+        merged = _CachedTable(rows, None, None)
+        _merged_tables[sheet_name] = (parts, merged)
+        return merged
+
+
+def table_rows(sheet_name):
+    """sheet_cache.rows() across all shards. Treat as read-only."""
+    return table_entry(sheet_name).rows
+
+
+def table_index(sheet_name):
+    """sheet_cache.index() across all shards; row numbers refer to table_rows()."""
+    keys = shard_keys(sheet_name)
+    if len(keys) == 1:
+        return sheet_cache.index(keys[0])
+    entry = table_entry(sheet_name)
+    if entry.index is None:
+        entry.index = _first_column_index(entry.rows)
+    return entry.index
+
+
+def shard_map():
+    """{batch code: shard} from the Shards sheet (rows naming an unknown shard are ignored)."""
+    global _shard_map
+    entry = sheet_cache.entry('Shards')
+    cached_entry, mapping = _shard_map
+    if entry is not cached_entry:
+        mapping = {r[0]: r[1] for r in entry.rows[1:]
+                   if len(r) >= 2 and r[0] and r[1] in SHARD_SPREADSHEETS}
+        _shard_map = (entry, mapping)
+    return mapping
+
+
+def shard_for_batch(batch_code):
+    if len(SHARD_SPREADSHEETS) == 1:
+        return MAIN_SHARD
+    return shard_map().get(batch_code, MAIN_SHARD)
+
+
+def shard_for_trainee(trainee_id):
+    """Shard whose Trainees sheet holds the trainee (main if none does)."""
+    if len(SHARD_SPREADSHEETS) > 1:
+        for shard in SHARD_SPREADSHEETS:
+            if trainee_id in sheet_cache.index(sheet_key(shard, 'Trainees')):
+                return shard
+    return MAIN_SHARD
+
+
+def shard_batches():
+    """{shard: [batch codes in sheet order]}"""
+    tables = fan_out(sheet_cache.rows, [sheet_key(shard, 'Batches') for shard in SHARD_SPREADSHEETS])
+    return {shard: [r[0] for r in rows[1:] if r and r[0]]
+            for shard, rows in zip(SHARD_SPREADSHEETS, tables)}
+
+
+def _upsert_row(sheet_name, row):
+    """Overwrite the row whose first cell is row[0], or append it."""
+    sheet = get_sheet(sheet_name)
+    ids = sheet.col_values(1)
+    if row[0] in ids:
+        n = ids.index(row[0]) + 1
+        sheet.update([row], f"A{n}:{_col_letter(len(row))}{n}")
+    else:
+        sheet.append_row(row)
+    mark_table_changed(sheet_name)
+
+
+def trainer_shard(trainer_id):
+    """The shard all of a trainer's batches belong on with SHARD_BY=trainer."""
+    shards = shard_ids()
+    return shards[int(hashlib.sha1(trainer_id.encode('utf-8')).hexdigest(), 16) % len(shards)]
+
+
+def place_batch(batch_code, trainer_id=None):
+    """Shard a new batch is written to, recorded in the Shards sheet."""
+    if len(SHARD_SPREADSHEETS) == 1:
+        return MAIN_SHARD
+    mapping = shard_map()
+    if batch_code in mapping:
+        return mapping[batch_code]
+    if SHARD_BY == 'trainer' and trainer_id:
+        shard = trainer_shard(trainer_id)
+    else:
+        counts = {s: len(codes) for s, codes in shard_batches().items()}
+        shard = min(shard_ids(), key=lambda s: counts[s])
+    _upsert_row('Shards', [batch_code, shard, datetime.now().isoformat()])
+    return shard
+
+
+def delete_rows(sheet_name, row_numbers):
+    """Delete sheet rows (1-based) in one batchUpdate: merged into runs, deleted bottom-up."""
+    runs = []
+    for row_num in sorted(row_numbers):
+        if runs and runs[-1][1] == row_num - 1:
+            runs[-1][1] = row_num
+        else:
+            runs.append([row_num, row_num])
+    if not runs:
+        return
+    sheet = get_sheet(sheet_name)
+    get_sheets_client(split_key(sheet_name)[0]).batch_update({'requests': [
+        {'deleteDimension': {'range': {'sheetId': sheet.id, 'dimension': 'ROWS',
+                                       'startIndex': first - 1, 'endIndex': last}}}
+        for first, last in reversed(runs)
+    ]})
+    mark_table_changed(sheet_name)
+    sheet_cache.invalidate(sheet_name)
+
+
+# sheet -> column matched to pick a batch's rows (Results: the trainee ID, matched
+# against the batch's trainees)
+SHARD_MOVE_COLUMNS = {'Batches': 0, 'Trainees': 1, 'Attendance': 1, 'Results': 1}
+
+
+def move_batch(batch_code, target, dry_run=False):
+    """Move a batch, its trainees, attendance and results to another shard.
+
+    Rows are copied first (skipping IDs the target already holds, so a failed move can be
+    re-run), then the Shards sheet is pointed at the target so new writes go there, then
+    the rows are deleted from the source. Archived quarters stay where they are; reads
+    cover every shard's archives. Run it while nobody is writing to the batch.
+    Returns {sheet: rows moved}.
+    """
+    if target not in SHARD_SPREADSHEETS:
+        raise Exception(f"Unknown shard: {target}")
+    source = shard_for_batch(batch_code)
+    if source == target:
+        return {}
+
+    moving = {}
+    trainee_ids = set()
+    for sheet_name, col in SHARD_MOVE_COLUMNS.items():
+        wanted = trainee_ids if sheet_name == 'Results' else {batch_code}
+        values = get_sheet(sheet_key(source, sheet_name)).get_all_values()
+        moving[sheet_name] = [(n, row) for n, row in enumerate(values[1:], start=2)
+                              if len(row) > col and row[col] in wanted]
+        if sheet_name == 'Trainees':
+            trainee_ids = {row[0] for _, row in moving[sheet_name]}
+    if not moving['Batches']:
+        raise Exception(f"Batch {batch_code} not found on shard {source}")
+    if dry_run:
+        return {sheet_name: len(items) for sheet_name, items in moving.items()}
+
+    for sheet_name, items in moving.items():
+        if not items:
+            continue
+        key = sheet_key(target, sheet_name)
+        dest = get_sheet(key)
+        held = set(dest.col_values(1)[1:])
+        new_rows = [row for _, row in items if row[0] not in held]
+        if new_rows:
+            dest.append_rows(new_rows, value_input_option='RAW')
+            mark_table_changed(key)
+
+    _upsert_row('Shards', [batch_code, target, datetime.now().isoformat()])
+
+    for sheet_name, items in moving.items():
+        delete_rows(sheet_key(source, sheet_name), [n for n, _ in items])
+    return {sheet_name: len(items) for sheet_name, items in moving.items()}
+
+
+def plan_rebalance():
+    """[(batch code, from shard, to shard)] that evens out batch counts across shards.
+
+    The newest batches move first: they have the least history to copy. With
+    SHARD_BY=trainer, counts are not evened out: each trainer's batches move, as a group,
+    to trainer_shard() (which changes when shards are added), so place_batch() keeps
+    sending that trainer's new batches to the same place.
+    """
+    batches = shard_batches()
+    moves = []
+    if SHARD_BY == 'trainer':
+        tables = fan_out(sheet_cache.rows, [sheet_key(shard, 'Batches') for shard in batches])
+        for shard, rows in zip(batches, tables):
+            for row in rows[1:]:
+                trainer_id = row[2].strip() if len(row) > 2 else ''
+                if row and row[0] and trainer_id and trainer_shard(trainer_id) != shard:
+                    moves.append((row[0], shard, trainer_shard(trainer_id)))
+        return moves
+    while True:
+        full = max(batches, key=lambda s: len(batches[s]))
+        empty = min(batches, key=lambda s: len(batches[s]))
+        if len(batches[full]) - len(batches[empty]) <= 1:
+            return moves
+        code = batches[full].pop()
+        batches[empty].append(code)
+        moves.append((code, full, empty))
+
+# ==================== PARTITIONS ====================
+# Results and Attendance rows older than ARCHIVE_AFTER_DAYS are moved out of the hot sheets
+# into one archive worksheet per quarter (e.g. Results_2025Q4) by `flask --app app archive`.
+# The Partitions sheet lists each archive with its date range and row count, so a query
+# opens only the quarters it can touch, and a cached archive stays valid until its row
+# count in the manifest changes (archives are only ever appended to, by that command).
+
+ARCHIVE_AFTER_DAYS = int(os.environ.get("ARCHIVE_AFTER_DAYS", "180"))
+
+# sheet -> 0-based column holding the date its rows are partitioned by
+PARTITIONED_SHEETS = {'Results': 8, 'Attendance': 3}
+
+_PARTITION_RE = re.compile(r"^(%s)_(\d{4})Q([1-4])$" % '|'.join(PARTITIONED_SHEETS))
+_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+_QUARTER_LAST_DAY = {1: '03-31', 2: '06-30', 3: '09-30', 4: '12-31'}
+
+Partition = namedtuple('Partition', 'title sheet start end rows key')  # key: sheet_key() of the archive
+
+
+def partition_title(sheet_name, day):
+    """Archive worksheet for a 'YYYY-MM-DD' day, e.g. ('Results', '2025-11-03') -> 'Results_2025Q4'."""
+    return f"{sheet_name}_{day[:4]}Q{(int(day[5:7]) - 1) // 3 + 1}"
+
+
+def partition_bounds(title):
+    """(sheet, first day, last day) covered by an archive worksheet."""
+    m = _PARTITION_RE.match(title)
+    year, quarter = m.group(2), int(m.group(3))
+    return m.group(1), f"{year}-{3 * quarter - 2:02d}-01", f"{year}-{_QUARTER_LAST_DAY[quarter]}"
+
+
+def base_sheet(name):
+    """'Results_2025Q4' -> 'Results'; any other name is returned unchanged."""
+    m = _PARTITION_RE.match(name)
+    return m.group(1) if m else name
+
+
+def list_partitions(sheet_name, start=None, end=None):
+    """Archives of `sheet_name` on every shard overlapping [start, end] (inclusive, either
+    may be None), oldest first."""
+    partitions = []
+    manifests = fan_out(sheet_cache.rows, [sheet_key(shard, 'Partitions') for shard in SHARD_SPREADSHEETS])
+    for shard, manifest in zip(SHARD_SPREADSHEETS, manifests):
+        for row in manifest[1:]:
+            if len(row) < 5 or row[1] != sheet_name or not _PARTITION_RE.match(row[0]):
+                continue
+            _, first, last = partition_bounds(row[0])
+            if (start and last < start) or (end and first > end):
+                continue
+            try:
+                rows = int(row[4])
+            except ValueError:
+                rows = None  # hand-edited manifest: fall back to version checks
+            partitions.append(Partition(row[0], sheet_name, first, last, rows, sheet_key(shard, row[0])))
+    return sorted(partitions, key=lambda p: p.start)
+
+
+def partition_entries(sheet_name, start=None, end=None):
+    """Cached tables for the archives list_partitions() returns."""
+    return fan_out(lambda p: sheet_cache.entry(p.key, p.rows), list_partitions(sheet_name, start, end))
+
+
+def iter_partitioned_rows(sheet_name, start=None, end=None):
+    """Data rows of the archives overlapping [start, end], then of the hot sheet.
+
+    Only whole partitions are pruned; callers still filter rows by date if they need to.
+    """
+    for entry in partition_entries(sheet_name, start, end):
+        yield from entry.rows[1:]
+    yield from table_rows(sheet_name)[1:]
+
+
+def _record_partition(shard, title, row_count):
+    """Create or update the manifest row for an archive."""
+    sheet_name, first, last = partition_bounds(title)
+    _upsert_row(sheet_key(shard, 'Partitions'),
+                [title, sheet_name, first, last, row_count, datetime.now().isoformat()])
+
+
+def archive_sheet(sheet_name, days=ARCHIVE_AFTER_DAYS, dry_run=False, shard=MAIN_SHARD):
+    """Move rows dated more than `days` ago from a hot sheet into its quarterly archives.
+
+    Rows are appended to the archive first (skipping IDs it already holds, so re-running
+    after a failure doesn't duplicate anything), then the manifest is updated, then the rows
+    are deleted from the hot sheet in one batchUpdate. Ungraded results stay in Results so
+    the review queue never has to read an archive. Archives stay on the shard the rows
+    came from. Returns {archive title: rows moved}.
+    """
+    date_col = PARTITIONED_SHEETS[sheet_name]
+    cutoff = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+    sheet = get_sheet(sheet_key(shard, sheet_name))
+
+    moving = {}
+    for row_num, row in enumerate(sheet.get_all_values()[1:], start=2):
+        day = row[date_col][:10] if len(row) > date_col else ''
+        if not _DATE_RE.match(day) or day >= cutoff:
+            continue
+        if sheet_name == 'Results' and (len(row) < 8 or row[7] == ''):
+            continue
+        moving.setdefault(partition_title(sheet_name, day), []).append((row_num, row))
+    if dry_run or not moving:
+        return {title: len(items) for title, items in moving.items()}
+
+    for title, items in sorted(moving.items()):
+        archive = get_sheet(sheet_key(shard, title))
+        ids = archive.col_values(1)
+        held = set(ids[1:])
+        new_rows = [row for _, row in items if row[0] not in held]
+        if new_rows:
+            archive.append_rows(new_rows if ids else [SHEET_STRUCTURE[sheet_name]] + new_rows,
+                                value_input_option='RAW')
+        _record_partition(shard, title, max(len(ids) - 1, 0) + len(new_rows))
+        mark_table_changed(sheet_key(shard, title))
+
+    delete_rows(sheet_key(shard, sheet_name), [n for items in moving.values() for n, _ in items])
+    return {title: len(items) for title, items in moving.items()}
+
+# ==================== ROW ORDER ====================
+# Sorted views of cached sheets so range queries ("results since T", "attendance on D")
+# bisect instead of scanning. Results are keyed by creation time: the ULID in the ID, or
+# the ISO Timestamp column. Legacy rows without either sort at their append position;
+# `flask --app app backfill-order --format ...` can convert their timestamps to ISO.
+
+# sheet -> 0-based Timestamp column
+ROW_TIMESTAMP_COLUMNS = {'Results': 8, 'Attendance': 5, 'Trainees': 5}
+
+
+def parse_timestamp_ms(value):
+    """Epoch ms of an ISO date/datetime string, or None."""
+    try:
+        return int(datetime.fromisoformat(value).timestamp() * 1000)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_legacy_timestamp(value, fmt):
+    value = (value or '').split(' GMT')[0].strip()  # "Mon Jan 05 2025 10:00:00 GMT+0530 (...)"
+    try:
+        return datetime.strptime(value, fmt)
+    except ValueError:
+        return None
+
+
+def row_created_ms(sheet_name, row):
+    """When a row was created: from its ULID, else its Timestamp column; None if neither parses."""
+    ms = ulid_ms(row[0]) if row else None
+    if ms is None:
+        col = ROW_TIMESTAMP_COLUMNS[sheet_name]
+        ms = parse_timestamp_ms(row[col]) if len(row) > col else None
+    return ms
+
+
+class SortedRowIndex:
+    """Row numbers of one cached sheet ordered by `key(row)`, for bisecting ranges.
+
+    Append-ordered sheets arrive already sorted, so a build is one pass and a tail-synced
+    refresh only extends the arrays; rows out of order switch to a sorted copy. With
+    `fill_forward`, a row without a key takes the previous row's key (its append position).
+    """
+
+    def __init__(self, sheet_name, key, fill_forward=False):
+        self.sheet_name = sheet_name
+        self.key = key
+        self.fill_forward = fill_forward
+        self._lock = threading.RLock()
+        self._source = None
+        self._keys = []
+        self._rows = []  # sheet row numbers, parallel to _keys
+        self._in_row_order = True
+
+    def _add(self, rows, first_row_num):
+        keys, nums = self._keys, self._rows
+        prev = keys[-1] if keys else None
+        ordered = self._in_row_order
+        for n, row in enumerate(rows, start=first_row_num):
+            k = self.key(row)
+            if k is None and self.fill_forward:
+                k = prev
+            if k is None:
+                continue
+            if prev is not None and k < prev:
+                ordered = False
+            keys.append(k)
+            nums.append(n)
+            prev = k if prev is None or k > prev else prev
+        if not ordered:
+            # Timsort makes this close to linear when only a few rows are out of place.
+            pairs = sorted(zip(keys, nums))
+            self._keys, self._rows = [k for k, _ in pairs], [n for _, n in pairs]
+        self._in_row_order = ordered
+
+    def ensure_loaded(self):
+        entry = sheet_cache.entry(self.sheet_name)
+        with self._lock:
+            if entry is self._source:
+                return entry
+            # Keys come from ID/Timestamp/Date, which tail-sync never patches.
+            if self._source is not None and entry.base_generation == self._source.generation:
+                self._add(entry.rows[entry.appended_from:], entry.appended_from + 1)
+            else:
+                self._keys, self._rows, self._in_row_order = [], [], True
+                self._add(entry.rows[1:], 2)
+            self._source = entry
+            return entry
+
+    def rows_between(self, lo=None, hi=None):
+        """Rows whose key is in [lo, hi] (inclusive; either may be None), in key order."""
+        with self._lock:
+            entry = self.ensure_loaded()
+            i = bisect.bisect_left(self._keys, lo) if lo is not None else 0
+            j = bisect.bisect_right(self._keys, hi) if hi is not None else len(self._keys)
+            return [entry.rows[n - 1] for n in self._rows[i:j]]
+
+    def seek(self, lo):
+        """Sheet row number from which every row with key >= lo follows (2 if unknown)."""
+        with self._lock:
+            entry = self.ensure_loaded()
+            if not self._in_row_order:
+                return 2
+            i = bisect.bisect_left(self._keys, lo)
+            return self._rows[i] if i < len(self._rows) else len(entry.rows) + 1
+
+
+# sheet -> (key, fill_forward): Results by creation time, Attendance by date
+ROW_INDEX_ORDER = {
+    'Results': (lambda row: row_created_ms('Results', row), True),
+    'Attendance': (lambda row: row[3][:10] if len(row) > 3 and _DATE_RE.match(row[3][:10]) else None, False),
+}
+_row_indexes = {}
+_row_indexes_lock = threading.Lock()
+
+
+def row_index(sheet_name, shard=MAIN_SHARD):
+    """The SortedRowIndex of one shard's Results or Attendance sheet."""
+    key = sheet_key(shard, sheet_name)
+    with _row_indexes_lock:
+        index = _row_indexes.get(key)
+        if index is None:
+            order, fill_forward = ROW_INDEX_ORDER[sheet_name]
+            index = _row_indexes[key] = SortedRowIndex(key, order, fill_forward)
+        return index
+
+
+def rows_between(sheet_name, lo=None, hi=None, shards=None):
+    """Rows keyed in [lo, hi] from every shard (or just `shards`); key order within each shard."""
+    parts = fan_out(lambda shard: row_index(sheet_name, shard).rows_between(lo, hi),
+                    shards if shards is not None else shard_ids())
+    return [row for part in parts for row in part]
+
+
+def backfill_timestamps(sheet_name, fmt, dry_run=False, shard=MAIN_SHARD):
+    """Rewrite Timestamp cells stored in `fmt` (a strptime format) as ISO, so those rows get
+    an exact ordering key instead of their append position.
+
+    Rows with ULID IDs or ISO timestamps, and empty cells, are left as they are; nothing is
+    ever filled in. Raises ValueError, writing nothing, if a non-empty cell doesn't parse
+    with `fmt` or the converted times aren't in row order: the sheet is append-ordered, so
+    either means `fmt` misreads it (typically day and month swapped). All cells go out in
+    one batched update. Returns (cells rewritten, empty cells left alone).
+    """
+    col = ROW_TIMESTAMP_COLUMNS[sheet_name]
+    key = sheet_key(shard, sheet_name)
+    sheet = get_sheet(key)
+    updates = []
+    empty = 0
+    prev = None  # (datetime, row number) of the last row with a known time
+    for n, row in enumerate(sheet.get_all_values()[1:], start=2):
+        value = row[col] if len(row) > col else ''
+        ms = row_created_ms(sheet_name, row)
+        if ms is not None:
+            when = datetime.fromtimestamp(ms / 1000)
+        elif not value.strip():
+            empty += 1
+            continue
+        else:
+            when = _parse_legacy_timestamp(value, fmt)
+            if when is None:
+                raise ValueError(f"{key} row {n}: {value!r} does not match --format")
+            updates.append({'range': f"{_col_letter(col + 1)}{n}", 'values': [[when.isoformat()]]})
+        if prev and when < prev[0]:
+            raise ValueError(f"{key} row {n} ({when.isoformat()}) would sort before row {prev[1]} "
+                             f"({prev[0].isoformat()}); is --format right?")
+        prev = (when, n)
+    if updates and not dry_run:
+        sheet.batch_update(updates, value_input_option='RAW')
+        mark_table_changed(key)
+        sheet_cache.invalidate(key)
+    return len(updates), empty
+
+# ==================== ATTENDANCE ENGINE ====================
+
+# One byte per (trainee, day). 0 = no record; statuses not listed here (e.g. 'L')
+# get the next free code the first time they are seen.
+ATTENDANCE_STATUS_CODES = {'P': 1, 'A': 2}
+
+
+class _BatchAttendance:
+    """Attendance grid for one batch: a bytearray column per date, indexed by trainee slot."""
+
+    __slots__ = ('trainee_ids', 'trainee_slots', 'dates', 'columns')
+
+    def __init__(self):
+        self.trainee_ids = []
+        self.trainee_slots = {}
+        self.dates = []    # sorted 'YYYY-MM-DD' strings
+        self.columns = {}  # date -> bytearray of status codes
+
+    def slot(self, trainee_id):
+        s = self.trainee_slots.get(trainee_id)
+        if s is None:
+            s = len(self.trainee_ids)
+            self.trainee_ids.append(trainee_id)
+            self.trainee_slots[trainee_id] = s
+        return s
+
+    def set(self, trainee_id, date, code):
+        s = self.slot(trainee_id)
+        col = self.columns.get(date)
+        if col is None:
+            col = self.columns[date] = bytearray()
+            bisect.insort(self.dates, date)
+        if len(col) <= s:
+            col.extend(bytes(s + 1 - len(col)))
+        col[s] = code
+
+    def dates_between(self, start=None, end=None):
+        lo = bisect.bisect_left(self.dates, start) if start else 0
+        hi = bisect.bisect_right(self.dates, end) if end else len(self.dates)
+        return self.dates[lo:hi]
+
+
+class AttendanceStore:
+    """Compact in-memory copy of the Attendance sheet and its archives, grouped by batch.
+
+    Rebuilt from the cached Attendance rows whenever the sheet cache reloads them, so
+    reads never scan the sheet. A re-save for the same trainee/date overwrites
+    the earlier status (last row wins), matching what the user sees in the UI.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._sources = []  # the sheet_cache entries (one per shard) the grids were built from
+        self._archives = []  # ... and the archive partition entries
+        self._reset()
+
+    def _reset(self):
+        self._batches = {}
+        self._trainee_batches = {}
+        self._rates = None
+        self._codes = dict(ATTENDANCE_STATUS_CODES)
+        self._names = {v: k for k, v in self._codes.items()}
+
+    def _code(self, status):
+        code = self._codes.get(status)
+        if code is None:
+            code = len(self._codes) + 1
+            if code > 255:
+                raise ValueError(f"Too many distinct attendance statuses (got {status!r})")
+            self._codes[status] = code
+            self._names[code] = status
+        return code
+
+    def _apply(self, row):
+        if len(row) < 5 or not row[1] or not row[2] or not row[3]:
+            return
+        batch_code, trainee_id, date, status = row[1], row[2], row[3][:10], row[4]
+        batch = self._batches.get(batch_code)
+        if batch is None:
+            batch = self._batches[batch_code] = _BatchAttendance()
+        batch.set(trainee_id, date, self._code(status))
+        self._trainee_batches.setdefault(trainee_id, set()).add(batch_code)
+
+    def ensure_loaded(self):
+        archives = partition_entries('Attendance')
+        entries = fan_out(sheet_cache.entry, shard_keys('Attendance'))
+        with self._lock:
+            same_archives = (len(archives) == len(self._archives)
+                             and all(a is b for a, b in zip(archives, self._archives)))
+            pairs = list(zip(entries, self._sources)) if len(entries) == len(self._sources) else None
+            if same_archives and pairs and all(new is old for new, old in pairs):
+                return
+            if same_archives and pairs and all(
+                    new is old or (not new.patched and new.base_generation == old.generation)
+                    for new, old in pairs):
+                # Tail-synced: only the newly appended rows need applying.
+                for new, old in pairs:
+                    if new is not old:
+                        for row in new.rows[new.appended_from:]:
+                            self._apply(row)
+            else:
+                # Archives first (oldest quarter first) so later rows still win.
+                self._reset()
+                for table in archives + entries:
+                    for row in table.rows[1:]:
+                        self._apply(row)
+            self._rates = None
+            self._sources = entries
+            self._archives = archives
+
+    def batch_codes(self):
+        self.ensure_loaded()
+        with self._lock:
+            return sorted(self._batches)
+
+    def batch_rates(self):
+        """{batch code: (days present, days recorded)} over all dates, kept until the sheet changes."""
+        self.ensure_loaded()
+        with self._lock:
+            if self._rates is None:
+                present_code = self._codes['P']
+                rates = {}
+                for batch_code, batch in self._batches.items():
+                    present = total = 0
+                    for col in batch.columns.values():
+                        present += col.count(present_code)
+                        total += len(col) - col.count(0)
+                    rates[batch_code] = (present, total)
+                self._rates = rates
+            return self._rates
+
+    def trainee_stats(self, trainee_id):
+        """Return (days recorded, days present) across every batch the trainee appears in.
+
+        Counts distinct days, not sheet rows: a day saved twice counts once, with its last status.
+        """
+        self.ensure_loaded()
+        present_code = self._codes['P']
+        total = present = 0
+        with self._lock:
+            for batch_code in self._trainee_batches.get(trainee_id, ()):
+                batch = self._batches[batch_code]
+                s = batch.trainee_slots[trainee_id]
+                for col in batch.columns.values():
+                    if s < len(col) and col[s]:
+                        total += 1
+                        if col[s] == present_code:
+                            present += 1
+        return total, present
+
+    def batch_report(self, batch_code, start=None, end=None):
+        """Grid, per-day totals and per-trainee percentages for one batch and date range."""
+        self.ensure_loaded()
+        present_code, absent_code = self._codes['P'], self._codes['A']
+        with self._lock:
+            batch = self._batches.get(batch_code)
+            if batch is None:
+                return {'batchCode': batch_code, 'dates': [], 'traineeIds': [],
+                        'grid': [], 'daily': [], 'trainees': []}
+
+            dates = batch.dates_between(start, end)
+            n = len(batch.trainee_ids)
+            names = self._names
+            cols = [bytes(batch.columns[d]).ljust(n, b'\0') for d in dates]
+
+            daily = []
+            for date, col in zip(dates, cols):
+                present = col.count(present_code)
+                absent = col.count(absent_code)
+                daily.append({
+                    'date': date,
+                    'present': present,
+                    'absent': absent,
+                    'total': n - col.count(0),
+                })
+
+            grid = []
+            trainees = []
+            for s, trainee_id in enumerate(batch.trainee_ids):
+                codes = bytes(col[s] for col in cols)
+                total = len(codes) - codes.count(0)
+                present = codes.count(present_code)
+                grid.append([names.get(c, '') for c in codes])
+                trainees.append({
+                    'traineeId': trainee_id,
+                    'present': present,
+                    'total': total,
+                    'percentage': round(present / total * 100) if total > 0 else 0,
+                })
+
+        return {
+            'batchCode': batch_code,
+            'dates': dates,
+            'traineeIds': list(batch.trainee_ids),
+            'grid': grid,
+            'daily': daily,
+            'trainees': trainees,
+        }
+
+
+attendance_store = AttendanceStore()
+
+# ==================== REPORT ENGINE ====================
+
+# Scores are 0-10 (see Reviews.tsx); a graded attempt at or above this counts as a pass.
+PASS_SCORE = float(os.environ.get("PASS_SCORE", "6"))
+REPORT_TABLES = ('Results', 'Trainees', 'Batches', 'Questions')
+
+
+_np = None
+
+def _numpy():
+    """NumPy if it is installed (imported on first report), else None."""
+    global _np
+    if _np is None:
+        try:
+            import numpy
+            _np = numpy
+        except ImportError:  # NumPy is optional; the report engine falls back to plain loops
+            _np = False
+    return _np or None
+
+
+def _factorize(values, seed=()):
+    """Map values to dense integer codes; returns (codes array, list of uniques).
+
+    `seed` values come first in the uniques even if they never occur in `values`.
+    """
+    index = {}
+    uniques = []
+    for v in seed:
+        if v not in index:
+            index[v] = len(uniques)
+            uniques.append(v)
+    codes = array('l')
+    for v in values:
+        c = index.get(v)
+        if c is None:
+            c = index[v] = len(uniques)
+            uniques.append(v)
+        codes.append(c)
+    return codes, uniques
+
+
+def _group_stats(codes, n_groups, scores, pass_score):
+    """Per-group attempts, graded count, score sum, best score, passes and 0-10 histogram.
+
+    `scores` holds NaN for attempts that are still waiting for a grade.
+    """
+    np = _numpy()
+    if np is not None:
+        codes = np.asarray(codes, dtype=np.int64)
+        scores = np.asarray(scores, dtype=np.float64)
+        graded = ~np.isnan(scores)
+        g_codes, g_scores = codes[graded], scores[graded]
+        best = np.full(n_groups, np.nan)
+        if len(g_codes):
+            np.fmax.at(best, g_codes, g_scores)
+        bins = np.clip(np.floor(g_scores), 0, 10).astype(np.int64)
+        hist = np.bincount(g_codes * 11 + bins, minlength=n_groups * 11).reshape(n_groups, 11)
+        return {
+            'attempts': np.bincount(codes, minlength=n_groups).tolist(),
+            'graded': np.bincount(g_codes, minlength=n_groups).tolist(),
+            'sum': np.bincount(g_codes, weights=g_scores, minlength=n_groups).tolist(),
+            'best': [None if b != b else b for b in best.tolist()],
+            'passed': np.bincount(g_codes[g_scores >= pass_score], minlength=n_groups).tolist(),
+            'histogram': hist.tolist(),
+        }
+
+    stats = {
+        'attempts': [0] * n_groups,
+        'graded': [0] * n_groups,
+        'sum': [0.0] * n_groups,
+        'best': [None] * n_groups,
+        'passed': [0] * n_groups,
+        'histogram': [[0] * 11 for _ in range(n_groups)],
+    }
+    for c, score in zip(codes, scores):
+        stats['attempts'][c] += 1
+        if score != score:  # NaN -> not graded yet
+            continue
+        stats['graded'][c] += 1
+        stats['sum'][c] += score
+        if stats['best'][c] is None or score > stats['best'][c]:
+            stats['best'][c] = score
+        if score >= pass_score:
+            stats['passed'][c] += 1
+        stats['histogram'][c][min(max(int(score), 0), 10)] += 1
+    return stats
+
+
+def _stats_row(stats, i):
+    graded = stats['graded'][i]
+    return {
+        'attempts': stats['attempts'][i],
+        'graded': graded,
+        'pending': stats['attempts'][i] - graded,
+        'averageScore': round(stats['sum'][i] / graded, 1) if graded else None,
+        'bestScore': stats['best'][i],
+        'passRate': round(stats['passed'][i] / graded * 100) if graded else None,
+    }
+
+
+class _ReportColumns:
+    """Results joined with Trainees/Batches, held as parallel column arrays.
+
+    Every batch in Batches (or with enrolled trainees) and every assigned trainer is a
+    group, so ones without any results still show up with zero counts.
+    """
+
+    def __init__(self, results_rows, trainee_rows, batch_rows, question_rows):
+        batch_trainer = {r[0]: r[2].strip() for r in batch_rows[1:] if len(r) >= 3 and r[0]}
+        trainee_batch = {r[0]: r[1] for r in trainee_rows[1:] if len(r) >= 2 and r[0]}
+
+        self.batch_trainer = batch_trainer
+        self.enrolled = {}
+        for batch_code in trainee_batch.values():
+            self.enrolled[batch_code] = self.enrolled.get(batch_code, 0) + 1
+        self.curriculum_size = len({r[0] for r in question_rows[1:] if r and r[0]})
+
+        trainees, modules, scores = [], [], array('d')
+        nan = float('nan')
+        for row in results_rows[1:]:
+            if len(row) < 4 or not row[1]:
+                continue
+            trainees.append(row[1])
+            modules.append(str(row[3]))
+            try:
+                scores.append(float(row[7]) if len(row) > 7 and row[7] != '' else nan)
+            except ValueError:
+                scores.append(nan)
+
+        self.trainee_codes, self.trainee_ids = _factorize(trainees)
+        self.module_codes, self.modules = _factorize(modules)
+        self.scores = scores
+        batches = [trainee_batch.get(t, '') for t in self.trainee_ids]
+        self.batch_codes, self.batches = _factorize(
+            (batches[c] for c in self.trainee_codes), seed=itertools.chain(batch_trainer, self.enrolled)
+        )
+        self.trainer_codes, self.trainers = _factorize(
+            (batch_trainer.get(b, '') for b in (self.batches[c] for c in self.batch_codes)),
+            seed=(t for t in batch_trainer.values() if t),
+        )
+
+    def rows_in_batch(self, batch_code):
+        if batch_code not in self.batches:
+            return []
+        b = self.batches.index(batch_code)
+        return [i for i, c in enumerate(self.batch_codes) if c == b]
+
+    def completed_pairs(self, group_codes, rows=None):
+        """Count distinct (trainee, module) pairs with a graded attempt, per group."""
+        seen = set()
+        counts = {}
+        for i in (range(len(self.scores)) if rows is None else rows):
+            s = self.scores[i]
+            pair = (self.trainee_codes[i], self.module_codes[i])
+            if s == s and pair not in seen:
+                seen.add(pair)
+                g = group_codes[i]
+                counts[g] = counts.get(g, 0) + 1
+        return counts
+
+
+class ReportEngine:
+    """Batch/module/trainer aggregates computed in one pass, cached until a source table reloads."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._columns = None
+        self._sources = None  # sheet_cache entries the columns were built from
+        self._cache = {}
+
+    def _ensure_columns(self):
+        sources = [table_entry(name) for name in REPORT_TABLES]
+        archives = partition_entries('Results')
+        stale = (
+            self._columns is None
+            or len(sources) + len(archives) != len(self._sources)
+            or any(a is not b for a, b in zip(sources + archives, self._sources))
+        )
+        if stale:
+            tables = [entry.rows for entry in sources]
+            if archives:
+                results = tables[0]
+                tables[0] = results[:1] + [row for a in archives for row in a.rows[1:]] + results[1:]
+            self._columns = _ReportColumns(*tables)
+            self._sources = sources + archives
+            self._cache = {}
+        return self._columns
+
+    def _cached(self, key, compute):
+        with self._lock:
+            cols = self._ensure_columns()
+            if key not in self._cache:
+                self._cache[key] = compute(cols)
+            return self._cache[key]
+
+    def batches(self, pass_score=PASS_SCORE):
+        def compute(cols):
+            stats = _group_stats(cols.batch_codes, len(cols.batches), cols.scores, pass_score)
+            completed = cols.completed_pairs(cols.batch_codes)
+            out = []
+            for i, batch_code in enumerate(cols.batches):
+                enrolled = cols.enrolled.get(batch_code, 0)
+                possible = enrolled * cols.curriculum_size
+                out.append({
+                    'batchCode': batch_code,
+                    'trainerId': cols.batch_trainer.get(batch_code, ''),
+                    'trainees': enrolled,
+                    **_stats_row(stats, i),
+                    'completionRate': round(completed.get(i, 0) / possible * 100) if possible else None,
+                })
+            return out
+        return self._cached(('batches', pass_score), compute)
+
+    def modules(self, batch_code=None, pass_score=PASS_SCORE):
+        def compute(cols):
+            if batch_code is None:
+                rows = None
+                codes, scores = cols.module_codes, cols.scores
+                enrolled = sum(cols.enrolled.values())
+            else:
+                rows = cols.rows_in_batch(batch_code)
+                codes = array('l', (cols.module_codes[i] for i in rows))
+                scores = array('d', (cols.scores[i] for i in rows))
+                enrolled = cols.enrolled.get(batch_code, 0)
+
+            stats = _group_stats(codes, len(cols.modules), scores, pass_score)
+            finished = cols.completed_pairs(cols.module_codes, rows)
+
+            out = []
+            for i, module in enumerate(cols.modules):
+                if not stats['attempts'][i]:
+                    continue
+                out.append({
+                    'module': module,
+                    **_stats_row(stats, i),
+                    'completionRate': round(finished.get(i, 0) / enrolled * 100) if enrolled else None,
+                    'distribution': stats['histogram'][i],
+                })
+            out.sort(key=lambda m: (int(m['module']) if m['module'].isdigit() else float('inf'), m['module']))
+            return out
+        return self._cached(('modules', batch_code, pass_score), compute)
+
+    def trainers(self, pass_score=PASS_SCORE):
+        def compute(cols):
+            stats = _group_stats(cols.trainer_codes, len(cols.trainers), cols.scores, pass_score)
+            batch_counts = {}
+            for trainer_id in cols.batch_trainer.values():
+                batch_counts[trainer_id] = batch_counts.get(trainer_id, 0) + 1
+            return [
+                {'trainerId': trainer_id, 'batches': batch_counts.get(trainer_id, 0), **_stats_row(stats, i)}
+                for i, trainer_id in enumerate(cols.trainers)
+            ]
+        return self._cached(('trainers', pass_score), compute)
+
+
+report_engine = ReportEngine()
+
+# ==================== SCOPE HELPERS ====================
+
+def trainer_batches(trainer_id):
+    """Batch codes assigned to a trainer."""
+    rows = table_rows('Batches')
+    return {r[0] for r in rows[1:] if len(r) >= 3 and r[0] and r[2].strip() == trainer_id}
+
+def trainee_joined(trainee_id):
+    """'YYYY-MM-DD' the trainee was added, or None; nothing of theirs is dated earlier."""
+    row_num = table_index('Trainees').get(trainee_id)
+    if row_num is None:
+        return None
+    row = table_rows('Trainees')[row_num - 1]
+    day = row[5][:10] if len(row) > 5 else ''
+    return day if _DATE_RE.match(day) else None
+
+def trainees_in_batches(batch_codes):
+    """Trainee IDs enrolled in any of the given batches."""
+    if not batch_codes:
+        return set()
+    keys = {sheet_key(shard_for_batch(code), 'Trainees') for code in batch_codes}
+    return {r[0] for key in keys for r in sheet_cache.rows(key)[1:]
+            if len(r) >= 2 and r[0] and r[1] in batch_codes}
+
+# ==================== SESSIONS ====================
+# Login returns a signed session token carrying the user's ID and role (itsdangerous, which
+# ships with Flask). Endpoints decorated with @authenticated resolve it through an in-memory
+# principal cache that also holds a Trainer's batch and trainee scope, so role-scoped
+# requests need neither the userId/role query parameters nor a pass over Batches/Trainees.
+# Cached scopes are rebuilt after any write to Batches or Trainees (table versions), and
+# after PRINCIPAL_CACHE_SECONDS to pick up changes made elsewhere (other workers, hand edits).
+
+SESSION_TTL_SECONDS = int(os.environ.get("SESSION_TTL_SECONDS", str(12 * 3600)))
+PRINCIPAL_CACHE_SECONDS = 300
+# When set, role-scoped endpoints no longer accept userId/role query parameters.
+REQUIRE_SESSION_TOKENS = os.environ.get("REQUIRE_SESSION_TOKENS", "").lower() in ('1', 'true', 'yes')
+
+# Must be the same on every worker and across restarts, or issued tokens stop verifying.
+# Only needed once a token is signed or checked, so CLI commands run without it.
+app.secret_key = os.environ.get("SECRET_KEY")
+_session_key_lock = threading.Lock()
+
+Principal = namedtuple('Principal', 'user_id role batches trainees')  # scopes are None for Owners
+
+
+class SessionError(Exception):
+    pass
+
+
+def _session_serializer():
+    """Token signer. Without SECRET_KEY this process signs with its own random key (tokens
+    then don't survive a restart or work on other workers, and fall back to the query
+    parameters); with REQUIRE_SESSION_TOKENS set, SECRET_KEY is mandatory.
+    """
+    from itsdangerous import URLSafeTimedSerializer
+
+    with _session_key_lock:
+        if not app.secret_key:
+            if REQUIRE_SESSION_TOKENS:
+                raise RuntimeError("SECRET_KEY must be set when REQUIRE_SESSION_TOKENS is on")
+            print("SECRET_KEY is not set: signing session tokens with a per-process key. "
+                  "See PYTHON_BACKEND_README.md.")
+            app.secret_key = os.urandom(32).hex()
+    return URLSafeTimedSerializer(app.secret_key, salt='session')
+
+
+def issue_session(user_id, role):
+    """Signed token for a logged-in user."""
+    return _session_serializer().dumps({'uid': user_id, 'role': role})
+
+
+class PrincipalCache:
+    def __init__(self, ttl=PRINCIPAL_CACHE_SECONDS):
+        self._lock = threading.Lock()
+        self._entries = {}  # (user ID, role) -> (Principal, table versions, monotonic time built)
+        self._ttl = ttl
+
+    def _versions(self):
+        return table_versions(*shard_keys('Batches'), *shard_keys('Trainees'))
+
+    def get(self, user_id, role):
+        versions = self._versions()
+        with self._lock:
+            hit = self._entries.get((user_id, role))
+        if hit and hit[1] == versions and time.monotonic() - hit[2] <= self._ttl:
+            return hit[0]
+        if role == 'Owner':
+            principal = Principal(user_id, role, None, None)
+        else:
+            batches = frozenset(trainer_batches(user_id)) if role == 'Trainer' else frozenset()
+            principal = Principal(user_id, role, batches, frozenset(trainees_in_batches(batches)))
+        with self._lock:
+            self._entries[(user_id, role)] = (principal, versions, time.monotonic())
+        return principal
+
+
+principal_cache = PrincipalCache()
+
+
+def resolve_session():
+    """Principal for the request's session token, or None if it carries none.
+
+    The token comes from `Authorization: Bearer ...`, or `?token=` for EventSource, which
+    can't set headers. Raises SessionError if it is forged or expired.
+    """
+    from itsdangerous import BadSignature, SignatureExpired
+
+    auth = request.headers.get('Authorization', '')
+    token = auth[7:].strip() if auth.startswith('Bearer ') else request.args.get('token')
+    if not token:
+        return None
+    try:
+        data = _session_serializer().loads(token, max_age=SESSION_TTL_SECONDS)
+    except SignatureExpired:
+        raise SessionError('Session expired, please log in again')
+    except BadSignature:
+        raise SessionError('Invalid session token')
+    return principal_cache.get(data['uid'], data['role'])
+
+
+def authenticated(view):
+    """Put the caller's Principal in g.principal (None for legacy clients).
+
+    A bad or expired token is a 401 when REQUIRE_SESSION_TOKENS is set; otherwise the
+    request is treated as carrying no token and falls back to the query parameters.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            g.principal = resolve_session()
+        except SessionError as e:
+            if REQUIRE_SESSION_TOKENS:
+                return jsonify({'status': 'error', 'message': str(e)}), 401
+            g.principal = None
+        if g.principal is None and REQUIRE_SESSION_TOKENS:
+            return jsonify({'status': 'error', 'message': 'Login required'}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def caller():
+    """(user ID, role) of the caller: from the session if there is one, else the query string."""
+    if g.principal is not None:
+        return g.principal.user_id, g.principal.role
+    return request.args.get('userId'), request.args.get('role')
+
+
+_users_by_email = (None, {})  # (Users cache entry, {email: row})
+
+
+def user_by_email(email):
+    """Users row for a (normalized) email, from an index rebuilt only when Users reloads."""
+    global _users_by_email
+    entry = sheet_cache.entry('Users')
+    cached_entry, index = _users_by_email
+    if entry is not cached_entry:
+        index = {}
+        for row in entry.rows[1:]:
+            if len(row) >= 5:
+                index.setdefault(row[2].lower().strip(), row)
+        _users_by_email = (entry, index)
+    return index.get(email)
+
+# ==================== CHANGE EVENTS ====================
+# In-process fan-out for Server-Sent Events. Write paths call publish_event(); each
+# connected client owns a small bounded queue. Events only reach clients connected to
+# the same process, so run the API as a single (threaded/gevent) worker when using them.
+# Each open stream holds one worker thread, so the number of streams is capped
+# (EVENT_MAX_SUBSCRIBERS, keep it below the worker's thread count) and extra clients get a 503.
+
+EVENT_MAX_SUBSCRIBERS = int(os.environ.get("EVENT_MAX_SUBSCRIBERS", "40"))
+EVENT_QUEUE_SIZE = 100
+EVENT_HISTORY_SIZE = 500
+EVENT_KEEPALIVE_SECONDS = 15
+
+
+class _Subscriber:
+    """One connected client. `batches`/`trainees` of None means "everything" (Owner)."""
+
+    def __init__(self, trainer_id=None, batches=None, trainees=None):
+        self.trainer_id = trainer_id
+        self.batches = batches
+        self.trainees = trainees
+        self.queue = queue.Queue(maxsize=EVENT_QUEUE_SIZE)
+        self.overflowed = False
+
+    def wants(self, event):
+        if self.batches is None:
+            return True
+        data = event['data']
+        batch_code = data.get('batchCode')
+        # Keep a trainer's scope current as batches/trainees are added.
+        if event['type'] == 'batch.created' and self.trainer_id and data.get('trainerId') == self.trainer_id:
+            self.batches.add(batch_code)
+        if event['type'] in ('batch.created', 'trainees.added') and batch_code in self.batches:
+            self.trainees.update(data.get('traineeIds', ()))
+        return batch_code in self.batches or data.get('traineeId') in self.trainees
+
+
+class EventBus:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._history = deque(maxlen=EVENT_HISTORY_SIZE)
+        self._next_id = 1
+
+    def subscribe(self, subscriber, last_event_id=None):
+        """Register a client, queueing any retained events it missed since `last_event_id`.
+
+        Returns None (nothing registered) once EVENT_MAX_SUBSCRIBERS streams are open.
+        """
+        with self._lock:
+            if len(self._subscribers) >= EVENT_MAX_SUBSCRIBERS:
+                return None
+            if last_event_id is not None:
+                for event in self._history:
+                    if event['id'] > last_event_id and subscriber.wants(event):
+                        try:
+                            subscriber.queue.put_nowait(event)
+                        except queue.Full:
+                            subscriber.overflowed = True
+                            break
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, event_type, **data):
+        with self._lock:
+            event = {
+                'id': self._next_id,
+                'type': event_type,
+                'timestamp': datetime.now().isoformat(),
+                'data': data,
+            }
+            self._next_id += 1
+            self._history.append(event)
+            for sub in self._subscribers:
+                if not sub.wants(event):
+                    continue
+                try:
+                    sub.queue.put_nowait(event)
+                except queue.Full:
+                    # Slow client: drop and tell it to refetch instead of blocking writers.
+                    sub.overflowed = True
+        return event
+
+
+event_bus = EventBus()
+
+def publish_event(event_type, **data):
+    """Best-effort notification; never lets a broken subscriber fail a write request."""
+    try:
+        event_bus.publish(event_type, **data)
+    except Exception as e:
+        print(f"Publish event error: {e}")
+
+# ==================== IDEMPOTENCY ====================
+# A client that retries a write with the same Idempotency-Key header gets the first
+# response replayed instead of the write running twice (duplicate rows, re-uploads).
+# Completed responses are kept per process in a bounded LRU with a time-to-live; a retry
+# that arrives while the first call is still running waits for it.
+
+IDEMPOTENCY_TTL_SECONDS = float(os.environ.get("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+IDEMPOTENCY_MAX_KEYS = int(os.environ.get("IDEMPOTENCY_MAX_KEYS", "1000"))
+IDEMPOTENCY_WAIT_SECONDS = 300  # how long a retry waits on an in-flight original
+
+
+class _IdempotentCall:
+    __slots__ = ('fingerprint', 'created_at', 'done', 'response')
+
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.created_at = time.monotonic()
+        self.done = threading.Event()
+        self.response = None  # (body, status, mimetype) once finished successfully
+
+
+class IdempotencyStore:
+    def __init__(self, max_keys=IDEMPOTENCY_MAX_KEYS, ttl=IDEMPOTENCY_TTL_SECONDS):
+        self._lock = threading.Lock()
+        self._calls = OrderedDict()
+        self.max_keys = max_keys
+        self.ttl = ttl
+
+    def begin(self, scope, fingerprint):
+        """Return (call, True) if the caller should run the request, else (existing call, False)."""
+        with self._lock:
+            call = self._calls.get(scope)
+            if call is not None and time.monotonic() - call.created_at <= self.ttl:
+                self._calls.move_to_end(scope)
+                return call, False
+            call = self._calls[scope] = _IdempotentCall(fingerprint)
+            self._calls.move_to_end(scope)
+            while len(self._calls) > self.max_keys:
+                self._calls.popitem(last=False)
+            return call, True
+
+    def finish(self, scope, call, response):
+        """Store the response, or forget the key when `response` is None so a retry runs again."""
+        call.response = response
+        if response is None:
+            with self._lock:
+                if self._calls.get(scope) is call:
+                    del self._calls[scope]
+        call.done.set()
+
+
+idempotency_store = IdempotencyStore()
+
+
+def idempotent(view):
+    """Honour an Idempotency-Key header on a write endpoint.
+
+    Responses below 500 are stored and replayed (with an Idempotent-Replayed header); server
+    errors are not, so the client can retry them. Reusing a key with a different body is a 422.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return view(*args, **kwargs)
+        scope = (request.path, key)
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+
+        while True:
+            call, owner = idempotency_store.begin(scope, fingerprint)
+            if owner:
+                break
+            if call.fingerprint != fingerprint:
+                return jsonify({'status': 'error',
+                                'message': 'Idempotency-Key was already used for a different request'}), 422
+            if not call.done.wait(IDEMPOTENCY_WAIT_SECONDS):
+                return jsonify({'status': 'error',
+                                'message': 'A request with this Idempotency-Key is still in progress'}), 409
+            if call.response is not None:
+                body, status, mimetype = call.response
+                replay = Response(body, status=status, mimetype=mimetype)
+                replay.headers['Idempotent-Replayed'] = 'true'
+                return replay
+            # The original failed and released the key; try to claim it ourselves.
+
+        try:
+            response = app.make_response(view(*args, **kwargs))
+        except Exception:
+            idempotency_store.finish(scope, call, None)
+            raise
+        stored = None
+        if response.status_code < 500 and not response.is_streamed:
+            stored = (response.get_data(), response.status_code, response.mimetype)
+        idempotency_store.finish(scope, call, stored)
+        return response
+    return wrapper
+
+# ==================== RESPONSES ====================
+# Large list endpoints go through json_response(): orjson when it is installed, the bytes
+# cached under a key built from the sheet cache generations they were computed from (so an
+# unchanged list is neither rebuilt nor re-serialized), and brotli/gzip for bodies above
+# RESPONSE_COMPRESS_MIN_BYTES when the client accepts it.
+
+RESPONSE_COMPRESS_MIN_BYTES = int(os.environ.get("RESPONSE_COMPRESS_MIN_BYTES", "1024"))
+RESPONSE_CACHE_SIZE = 256
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+_optional_modules = {}
+
+def _optional(name):
+    """Import an optional dependency on first use; None if it isn't installed."""
+    if name not in _optional_modules:
+        try:
+            _optional_modules[name] = __import__(name)
+        except ImportError:
+            _optional_modules[name] = None
+    return _optional_modules[name]
+
+
+def dumps_json(payload):
+    """Compact UTF-8 JSON bytes."""
+    orjson = _optional('orjson')
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class _EncodedBody:
+    """Serialized JSON plus lazily built compressed variants."""
+
+    __slots__ = ('body', 'etag', 'variants')
+
+    def __init__(self, body):
+        self.body = body
+        self.etag = hashlib.blake2b(body, digest_size=12).hexdigest()
+        self.variants = {}
+
+    def encoded(self, encoding):
+        data = self.variants.get(encoding)
+        if data is None:
+            if encoding == 'br':
+                data = _optional('brotli').compress(self.body, quality=BROTLI_QUALITY)
+            else:
+                data = gzip.compress(self.body, compresslevel=GZIP_LEVEL, mtime=0)
+            self.variants[encoding] = data
+        return data
+
+
+_response_cache = OrderedDict()
+_response_cache_lock = threading.Lock()
+
+
+def cache_generations(*sheet_names):
+    """Generations of the cached sheets (across shards); they change only when a sheet's values do."""
+    return tuple(table_entry(name).generation for name in sheet_names)
+
+
+def _negotiate_encoding(size):
+    if size < RESPONSE_COMPRESS_MIN_BYTES:
+        return None
+    accepted = request.accept_encodings
+    if accepted['br'] and _optional('brotli') is not None:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def json_response(build, key=None):
+    """JSON response for `build()`, reusing the serialized bytes stored under `key`."""
+    encoded = None
+    if key is not None:
+        with _response_cache_lock:
+            encoded = _response_cache.get(key)
+            if encoded is not None:
+                _response_cache.move_to_end(key)
+    if encoded is None:
+        encoded = _EncodedBody(dumps_json(build()))
+        if key is not None:
+            with _response_cache_lock:
+                _response_cache[key] = encoded
+                while len(_response_cache) > RESPONSE_CACHE_SIZE:
+                    _response_cache.popitem(last=False)
+
+    if request.if_none_match.contains_weak(encoded.etag):
+        response = Response(status=304)
+    else:
+        encoding = _negotiate_encoding(len(encoded.body))
+        response = Response(encoded.encoded(encoding) if encoding else encoded.body,
+                            mimetype='application/json')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(encoded.etag, weak=True)
+    response.vary.add('Accept-Encoding')
+    return response
 
 # ==================== AUTHENTICATION ====================
 
@@ -309,28 +2400,27 @@ def login():
         email = data.get('email', '').lower().strip()
         password = data.get('password', '')
         
-        sheet = get_sheet('Users')
-        rows = sheet.get_all_values()
+        row = user_by_email(email)
         
-        for i, row in enumerate(rows[1:], start=2):  # Skip header
-            if len(row) >= 5 and row[2].lower().strip() == email:
-                # Check for pending setup
-                if row[3] == 'PENDING_SETUP':
-                    return jsonify({
-                        'status': 'error',
-                        'message': 'Account pending. Please check your email to set a password.'
-                    })
-                # Check password
-                if row[3] == password:
-                    return jsonify({
-                        'status': 'success',
-                        'user': {
-                            'id': row[0],
-                            'name': row[1],
-                            'email': row[2],
-                            'role': row[4]
-                        }
-                    })
+        if row is not None:
+            # Check for pending setup
+            if row[3] == 'PENDING_SETUP':
+                return jsonify({
+                    'status': 'error',
+                    'message': 'Account pending. Please check your email to set a password.'
+                })
+            # Check password
+            if row[3] == password:
+                return jsonify({
+                    'status': 'success',
+                    'user': {
+                        'id': row[0],
+                        'name': row[1],
+                        'email': row[2],
+                        'role': row[4],
+                        'token': issue_session(row[0], row[4])
+                    }
+                })
         
         return jsonify({'status': 'error', 'message': 'Invalid Credentials'})
     except Exception as e:
@@ -338,6 +2428,7 @@ def login():
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 @app.route('/api/auth/register', methods=['POST'])
+@idempotent
 def register():
     """Register new user - writes to Users sheet"""
     try:
@@ -345,7 +2436,7 @@ def register():
         email = data.get('email', '').lower().strip()
         
         sheet = get_sheet('Users')
-        rows = sheet.get_all_values()
+        rows = sheet_cache.rows('Users')
         
         # Check if email exists
         for row in rows[1:]:
@@ -363,6 +2454,7 @@ def register():
             datetime.now().isoformat()
         ]
         sheet.append_row(new_row)
+        mark_table_changed('Users')
         
         return jsonify({
             'status': 'success',
@@ -370,7 +2462,8 @@ def register():
                 'id': user_id,
                 'name': data.get('name'),
                 'email': email,
-                'role': data.get('role')
+                'role': data.get('role'),
+                'token': issue_session(user_id, new_row[4])
             }
         })
     except Exception as e:
@@ -378,6 +2471,7 @@ def register():
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 @app.route('/api/auth/setup', methods=['POST'])
+@idempotent
 def complete_setup():
     """Complete trainer setup - updates password (same as completeSetup in Code.gs)"""
     try:
@@ -392,13 +2486,15 @@ def complete_setup():
             if len(row) >= 5 and row[2].lower().strip() == email:
                 # Update password (column 4)
                 sheet.update_cell(i, 4, password)
+                mark_table_changed('Users')
                 return jsonify({
                     'status': 'success',
                     'user': {
                         'id': row[0],
                         'name': row[1],
                         'email': row[2],
-                        'role': row[4]
+                        'role': row[4],
+                        'token': issue_session(row[0], row[4])
                     }
                 })
         
@@ -413,8 +2509,7 @@ def complete_setup():
 def get_trainers():
     """Get all trainers (same as getAllTrainers in Code.gs)"""
     try:
-        sheet = get_sheet('Users')
-        rows = sheet.get_all_values()
+        rows = sheet_cache.rows('Users')
         
         trainers = []
         for row in rows[1:]:
@@ -427,6 +2522,7 @@ def get_trainers():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/trainers/invite', methods=['POST'])
+@idempotent
 def invite_trainer():
     """Invite new trainer (same as inviteTrainer in Code.gs)"""
     try:
@@ -435,7 +2531,7 @@ def invite_trainer():
         name = data.get('name', '')
         
         sheet = get_sheet('Users')
-        rows = sheet.get_all_values()
+        rows = sheet_cache.rows('Users')
         
         # Check if email exists
         for row in rows[1:]:
@@ -453,6 +2549,7 @@ def invite_trainer():
             datetime.now().isoformat()
         ]
         sheet.append_row(new_row)
+        mark_table_changed('Users')
         
         # Note: Email sending requires SMTP setup
         # For now, return success with setup link info
@@ -466,43 +2563,49 @@ def invite_trainer():
 # ==================== BATCHES ====================
 
 @app.route('/api/batches', methods=['GET'])
+@authenticated
 def get_batches():
     """Get batches filtered by role (same as getMyBatches in Code.gs)"""
     try:
-        user_id = request.args.get('userId')
-        role = request.args.get('role')
+        user_id, role = caller()
         
-        sheet = get_sheet('Batches')
-        rows = sheet.get_all_values()
-        
-        batches = []
-        for row in rows[1:]:
-            if len(row) >= 4:
-                # If not Owner, filter by trainer_id
-                if role != 'Owner' and row[2].strip() != user_id:
-                    continue
-                batches.append({
-                    'code': row[0],
-                    'name': row[1],
-                    'trainerId': row[2],
-                    'startDate': row[3] if len(row) > 3 else '',
-                    'endDate': row[4] if len(row) > 4 else '',
-                    'maxCapacity': row[5] if len(row) > 5 else ''
-                })
+        def build():
+            rows = table_rows('Batches')  # every shard's batches
+            mine = g.principal.batches if g.principal is not None else None
+            
+            batches = []
+            for row in rows[1:]:
+                if len(row) >= 4:
+                    # If not Owner, filter by trainer_id (or the session's batch scope)
+                    if role != 'Owner' and (row[0] not in mine if mine is not None else row[2].strip() != user_id):
+                        continue
+                    batches.append({
+                        'code': row[0],
+                        'name': row[1],
+                        'trainerId': row[2],
+                        'startDate': row[3] if len(row) > 3 else '',
+                        'endDate': row[4] if len(row) > 4 else '',
+                        'maxCapacity': row[5] if len(row) > 5 else ''
+                    })
+            return batches
         
-        return jsonify(batches)
+        scope = 'Owner' if role == 'Owner' else user_id
+        return json_response(build, ('batches', scope, cache_generations('Batches')))
     except Exception as e:
         print(f"Get batches error: {e}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/batches', methods=['POST'])
+@idempotent
 def create_batch():
     """Create new batch with trainees (same as createBatch in Code.gs)"""
     try:
         data = request.json
         
-        batch_sheet = get_sheet('Batches')
-        trainee_sheet = get_sheet('Trainees')
+        shard = place_batch(data.get('batch_code'), data.get('trainer_id'))
+        batch_key, trainee_key = sheet_key(shard, 'Batches'), sheet_key(shard, 'Trainees')
+        batch_sheet = get_sheet(batch_key)
+        trainee_sheet = get_sheet(trainee_key)
         
         # Add batch
         batch_row = [
@@ -518,6 +2621,7 @@ def create_batch():
         
         # Add trainees
         trainees = data.get('trainees', [])
+        trainee_ids = []
         for t in trainees:
             if t.get('name'):
                 trainee_row = [
@@ -529,6 +2633,10 @@ def create_batch():
                     datetime.now().isoformat()
                 ]
                 trainee_sheet.append_row(trainee_row)
+                trainee_ids.append(trainee_row[0])
+        mark_table_changed(batch_key, trainee_key)
+        publish_event('batch.created', batchCode=data.get('batch_code'),
+                      trainerId=data.get('trainer_id'), traineeIds=trainee_ids)
         
         return jsonify({'status': 'success'})
     except Exception as e:
@@ -542,33 +2650,37 @@ def get_trainees():
     """Get trainees by batch (same as getTraineesByBatch in Code.gs)"""
     try:
         batch_code = request.args.get('batchCode')
+        key = sheet_key(shard_for_batch(batch_code), 'Trainees')
         
-        sheet = get_sheet('Trainees')
-        rows = sheet.get_all_values()
-        
-        trainees = []
-        for row in rows[1:]:
-            if len(row) >= 4 and row[1] == batch_code:
-                trainees.append({
-                    'id': row[0],
-                    'batchCode': row[1],
-                    'name': row[2],
-                    'mobile': row[3] if len(row) > 3 else '',
-                    'email': row[4] if len(row) > 4 else ''
-                })
+        def build():
+            rows = sheet_cache.rows(key)
+            
+            trainees = []
+            for row in rows[1:]:
+                if len(row) >= 4 and row[1] == batch_code:
+                    trainees.append({
+                        'id': row[0],
+                        'batchCode': row[1],
+                        'name': row[2],
+                        'mobile': row[3] if len(row) > 3 else '',
+                        'email': row[4] if len(row) > 4 else ''
+                    })
+            return trainees
         
-        return jsonify(trainees)
+        return json_response(build, ('trainees', batch_code, sheet_cache.entry(key).generation))
     except Exception as e:
         print(f"Get trainees error: {e}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/trainees', methods=['POST'])
+@idempotent
 def add_trainee():
     """Add single trainee (same as addSingleTrainee in Code.gs)"""
     try:
         data = request.json
         
-        sheet = get_sheet('Trainees')
+        key = sheet_key(shard_for_batch(data.get('batchCode')), 'Trainees')
+        sheet = get_sheet(key)
         trainee_row = [
             generate_id(),
             data.get('batchCode'),
@@ -578,6 +2690,8 @@ def add_trainee():
             datetime.now().isoformat()
         ]
         sheet.append_row(trainee_row)
+        mark_table_changed(key)
+        publish_event('trainees.added', batchCode=data.get('batchCode'), traineeIds=[trainee_row[0]])
         
         return jsonify({'status': 'success'})
     except Exception as e:
@@ -585,6 +2699,7 @@ def add_trainee():
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 @app.route('/api/trainees/bulk', methods=['POST'])
+@idempotent
 def bulk_add_trainees():
     """Bulk add trainees from CSV data"""
     try:
@@ -598,8 +2713,10 @@ def bulk_add_trainees():
         if not trainees_data:
             return jsonify({'status': 'error', 'message': 'No trainees data provided'}), 400
         
-        sheet = get_sheet('Trainees')
+        key = sheet_key(shard_for_batch(batch_code), 'Trainees')
+        sheet = get_sheet(key)
         added_count = 0
+        trainee_ids = []
         
         for t in trainees_data:
             name = t.get('name', '').strip()
@@ -613,7 +2730,10 @@ def bulk_add_trainees():
                     datetime.now().isoformat()
                 ]
                 sheet.append_row(trainee_row)
+                trainee_ids.append(trainee_row[0])
                 added_count += 1
+        mark_table_changed(key)
+        publish_event('trainees.added', batchCode=batch_code, traineeIds=trainee_ids)
         
         return jsonify({'status': 'success', 'added': added_count})
     except Exception as e:
@@ -658,96 +2778,86 @@ def parse_csv():
 def get_trainee_details(trainee_id):
     """Get trainee details with stats (same as getTraineeDetails in Code.gs)"""
     try:
-        # 1. Get trainee info
-        trainee_sheet = get_sheet('Trainees')
-        trainee_rows = trainee_sheet.get_all_values()
-        
-        trainee_data = None
-        for row in trainee_rows[1:]:
-            if len(row) >= 5 and row[0] == trainee_id:
-                trainee_data = row
-                break
-        
-        if not trainee_data:
-            return jsonify({'status': 'error', 'message': 'Trainee not found'})
-        
-        # 2. Calculate attendance stats
-        att_sheet = get_sheet('Attendance')
-        att_rows = att_sheet.get_all_values()
-        
-        total_att = 0
-        present_count = 0
-        for row in att_rows[1:]:
-            if len(row) >= 5 and row[2] == trainee_id:
-                total_att += 1
-                if row[4] == 'P':
-                    present_count += 1
-        
-        percentage = round((present_count / total_att * 100)) if total_att > 0 else 0
-        
-        # 3. Calculate module results
-        results_sheet = get_sheet('Results')
-        results_rows = results_sheet.get_all_values()
-        
-        mod_calc = {}
-        for row in results_rows[1:]:
-            if len(row) >= 8 and row[1] == trainee_id:
-                mod_num = row[3]
-                score = row[7]
+        def build():
+            # 1. Get trainee info (ID -> row index from the sheet cache)
+            trainee_data = None
+            row_num = table_index('Trainees').get(trainee_id)
+            if row_num is not None:
+                row = table_rows('Trainees')[row_num - 1]
+                if len(row) >= 5:
+                    trainee_data = row
+        
+            if not trainee_data:
+                return {'status': 'error', 'message': 'Trainee not found'}
+        
+            # 2. Calculate attendance stats (from the in-memory attendance store)
+            total_att, present_count = attendance_store.trainee_stats(trainee_id)
+        
+            percentage = round((present_count / total_att * 100)) if total_att > 0 else 0
+        
+            # 3. Calculate module results (archives from the quarter they joined onwards)
+            mod_calc = {}
+            for row in iter_partitioned_rows('Results', start=trainee_joined(trainee_id)):
+                if len(row) >= 8 and row[1] == trainee_id:
+                    mod_num = row[3]
+                    score = row[7]
                 
-                if mod_num not in mod_calc:
-                    mod_calc[mod_num] = {'sum': 0, 'count': 0, 'total_attempts': 0}
+                    if mod_num not in mod_calc:
+                        mod_calc[mod_num] = {'sum': 0, 'count': 0, 'total_attempts': 0}
                 
-                mod_calc[mod_num]['total_attempts'] += 1
-                if score and score != '':
-                    try:
-                        mod_calc[mod_num]['sum'] += float(score)
-                        mod_calc[mod_num]['count'] += 1
-                    except ValueError:
-                        pass
-        
-        modules = {}
-        for k, v in mod_calc.items():
-            if v['count'] > 0:
-                modules[k] = {
-                    'score': str(round(v['sum'] / v['count'], 1)),
-                    'attempts': v['total_attempts']
-                }
-            else:
-                modules[k] = {'score': 'Pending', 'attempts': v['total_attempts']}
+                    mod_calc[mod_num]['total_attempts'] += 1
+                    if score and score != '':
+                        try:
+                            mod_calc[mod_num]['sum'] += float(score)
+                            mod_calc[mod_num]['count'] += 1
+                        except ValueError:
+                            pass
+        
+            modules = {}
+            for k, v in mod_calc.items():
+                if v['count'] > 0:
+                    modules[k] = {
+                        'score': str(round(v['sum'] / v['count'], 1)),
+                        'attempts': v['total_attempts']
+                    }
+                else:
+                    modules[k] = {'score': 'Pending', 'attempts': v['total_attempts']}
         
-        # 4. Build curriculum from Questions sheet (dynamic like Code.gs)
-        questions_sheet = get_sheet('Questions')
-        q_rows = questions_sheet.get_all_values()
+            # 4. Build curriculum from Questions sheet (dynamic like Code.gs)
+            q_rows = sheet_cache.rows('Questions')
         
-        cat_map = {}
-        for row in q_rows[1:]:
-            if len(row) >= 2 and row[0] and row[1]:
-                mod_id = row[0]
-                cat_name = row[1]
+            cat_map = {}
+            for row in q_rows[1:]:
+                if len(row) >= 2 and row[0] and row[1]:
+                    mod_id = row[0]
+                    cat_name = row[1]
                 
-                if cat_name not in cat_map:
-                    cat_map[cat_name] = set()
-                cat_map[cat_name].add(mod_id)
-        
-        curriculum = []
-        for cat_name, mod_set in cat_map.items():
-            sorted_mods = sorted(list(mod_set), key=lambda x: (int(x) if x.isdigit() else float('inf'), x))
-            curriculum.append({'name': cat_name, 'modules': sorted_mods})
+                    if cat_name not in cat_map:
+                        cat_map[cat_name] = set()
+                    cat_map[cat_name].add(mod_id)
+        
+            curriculum = []
+            for cat_name, mod_set in cat_map.items():
+                sorted_mods = sorted(list(mod_set), key=lambda x: (int(x) if x.isdigit() else float('inf'), x))
+                curriculum.append({'name': cat_name, 'modules': sorted_mods})
+        
+            return {
+                'status': 'success',
+                'info': {
+                    'id': trainee_data[0],
+                    'batch': trainee_data[1],
+                    'name': trainee_data[2],
+                    'mobile': trainee_data[3] if len(trainee_data) > 3 else '',
+                    'email': trainee_data[4] if len(trainee_data) > 4 else ''
+                },
+                'stats': {'total': total_att, 'percentage': percentage},
+                'modules': modules,
+                'curriculum': curriculum
+            }
         
-        return jsonify({
-            'status': 'success',
-            'info': {
-                'id': trainee_data[0],
-                'batch': trainee_data[1],
-                'name': trainee_data[2],
-                'mobile': trainee_data[3] if len(trainee_data) > 3 else '',
-                'email': trainee_data[4] if len(trainee_data) > 4 else ''
-            },
-            'stats': {'total': total_att, 'percentage': percentage},
-            'modules': modules,
-            'curriculum': curriculum
-        })
+        key = ('trainee', trainee_id,
+               cache_generations('Trainees', 'Results', 'Attendance', 'Questions', 'Partitions'))
+        return json_response(build, key)
     except Exception as e:
         print(f"Get trainee details error: {e}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
@@ -755,6 +2865,7 @@ def get_trainee_details(trainee_id):
 # ==================== ATTENDANCE ====================
 
 @app.route('/api/attendance', methods=['POST'])
+@idempotent
 def save_attendance():
     """Save attendance records (same as saveAttendance in Code.gs)"""
     try:
@@ -763,7 +2874,8 @@ def save_attendance():
         date = data.get('date')
         records = data.get('records', [])
         
-        sheet = get_sheet('Attendance')
+        key = sheet_key(shard_for_batch(batch_code), 'Attendance')
+        sheet = get_sheet(key)
         
         for record in records:
             att_row = [
@@ -775,20 +2887,275 @@ def save_attendance():
                 datetime.now().isoformat()
             ]
             sheet.append_row(att_row)
+        mark_table_changed(key)
+        publish_event('attendance.saved', batchCode=batch_code, date=date, records=len(records))
         
         return jsonify({'status': 'success'})
     except Exception as e:
         print(f"Save attendance error: {e}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+@app.route('/api/attendance', methods=['GET'])
+def get_attendance_by_date():
+    """Attendance records for one day (?date=YYYY-MM-DD, optional &batchCode=X)"""
+    try:
+        date = request.args.get('date', '')
+        batch_code = request.args.get('batchCode')
+        if not _DATE_RE.match(date):
+            return jsonify({'error': 'date must be YYYY-MM-DD'}), 400
+        
+        shards = [shard_for_batch(batch_code)] if batch_code else None
+        # The day's quarter may already be archived; those rows are not in the hot index.
+        archived = [row for entry in partition_entries('Attendance', date, date)
+                    for row in entry.rows[1:] if len(row) > 3 and row[3][:10] == date]
+        records = []
+        for row in archived + rows_between('Attendance', date, date, shards):
+            if batch_code and row[1] != batch_code:
+                continue
+            records.append({
+                'recordId': row[0],
+                'batchCode': row[1],
+                'traineeId': row[2],
+                'date': row[3][:10],
+                'status': row[4] if len(row) > 4 else ''
+            })
+        
+        return jsonify(records)
+    except Exception as e:
+        print(f"Get attendance by date error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/attendance/<batch_code>', methods=['GET'])
+def get_batch_attendance(batch_code):
+    """Attendance grid for a batch: trainees x dates, plus daily totals and per-trainee %"""
+    try:
+        report = attendance_store.batch_report(
+            batch_code, request.args.get('from'), request.args.get('to')
+        )
+        return jsonify(report)
+    except Exception as e:
+        print(f"Get batch attendance error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/attendance/<batch_code>/daily', methods=['GET'])
+def get_batch_attendance_daily(batch_code):
+    """Per-day present/absent totals for a batch (optional ?from=YYYY-MM-DD&to=YYYY-MM-DD)"""
+    try:
+        report = attendance_store.batch_report(
+            batch_code, request.args.get('from'), request.args.get('to')
+        )
+        return jsonify(report['daily'])
+    except Exception as e:
+        print(f"Get daily attendance error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/attendance/<batch_code>/summary', methods=['GET'])
+def get_batch_attendance_summary(batch_code):
+    """Per-trainee attendance percentage for a batch over a date range"""
+    try:
+        report = attendance_store.batch_report(
+            batch_code, request.args.get('from'), request.args.get('to')
+        )
+        return jsonify(report['trainees'])
+    except Exception as e:
+        print(f"Get attendance summary error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+# ==================== UPLOADS ====================
+# Resumable uploads for assessment media. The client creates an upload, PUTs the file in
+# chunks (each one says the offset it starts at) and, after a dropped connection, asks
+# for the committed offset and carries on from there. Chunks are streamed into a spool
+# file on local disk and finalize streams that file to Drive, so memory use stays flat
+# however large the recording is.
+
+UPLOAD_SPOOL_DIR = os.environ.get("UPLOAD_SPOOL_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '.cache', 'uploads'
+)
+UPLOAD_MAX_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", str(1024 ** 3)))
+UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024  # suggested to clients
+UPLOAD_SPOOL_TTL_SECONDS = 24 * 3600
+_UPLOAD_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+_upload_locks = {}
+_upload_locks_lock = threading.Lock()
+
+
+def _upload_paths(upload_id):
+    """(metadata path, data path) for an upload; KeyError for malformed IDs."""
+    if not _UPLOAD_ID_RE.match(upload_id or ''):
+        raise KeyError(upload_id)
+    base = os.path.join(UPLOAD_SPOOL_DIR, upload_id)
+    return base + '.json', base + '.part'
+
+
+def _upload_lock(upload_id):
+    with _upload_locks_lock:
+        return _upload_locks.setdefault(upload_id, threading.Lock())
+
+
+def _save_upload_meta(upload_id, meta):
+    meta_path, _ = _upload_paths(upload_id)
+    tmp_path = f"{meta_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+
+
+def load_upload(upload_id):
+    """Upload metadata with the committed `offset`; KeyError if unknown or expired."""
+    meta_path, part_path = _upload_paths(upload_id)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if not meta.get('link'):
+            meta['offset'] = os.path.getsize(part_path)
+    except FileNotFoundError:
+        raise KeyError(upload_id)
+    return meta
+
+
+def _sweep_uploads():
+    """Remove spool files nobody has touched for UPLOAD_SPOOL_TTL_SECONDS."""
+    cutoff = time.time() - UPLOAD_SPOOL_TTL_SECONDS
+    for name in os.listdir(UPLOAD_SPOOL_DIR):
+        path = os.path.join(UPLOAD_SPOOL_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def create_upload(filename, mime_type, size=None):
+    os.makedirs(UPLOAD_SPOOL_DIR, exist_ok=True)
+    _sweep_uploads()
+    upload_id = uuid.uuid4().hex
+    _, part_path = _upload_paths(upload_id)
+    open(part_path, 'wb').close()
+    _save_upload_meta(upload_id, {
+        'filename': filename,
+        'mimeType': mime_type,
+        'size': size,
+        'created': datetime.now().isoformat(),
+    })
+    return upload_id
+
+
+def finalize_upload(upload_id, filename=None):
+    """Stream a complete upload from disk to Drive (only once) and return its link."""
+    with _upload_lock(upload_id):
+        meta = load_upload(upload_id)
+        if meta.get('link'):
+            return meta['link']
+        if meta.get('size') is not None and meta['offset'] != meta['size']:
+            raise Exception(f"Upload {upload_id} is incomplete: {meta['offset']} of {meta['size']} bytes")
+
+        _, part_path = _upload_paths(upload_id)
+        with open(part_path, 'rb') as f:
+            link = upload_stream_to_drive(f, filename or meta['filename'], meta['mimeType'])
+        meta['link'] = link
+        _save_upload_meta(upload_id, meta)
+        os.remove(part_path)
+        return link
+
+
+def _upload_status(upload_id, meta):
+    return {
+        'uploadId': upload_id,
+        'offset': meta['offset'],
+        'size': meta.get('size'),
+        'complete': bool(meta.get('link')),
+        'link': meta.get('link'),
+    }
+
+
+@app.route('/api/uploads', methods=['POST'])
+def initiate_upload():
+    """Start a resumable upload: {filename, mimeType, size?} -> {uploadId, offset, chunkSize}"""
+    try:
+        data = request.json or {}
+        size = data.get('size')
+        if size is not None and (not isinstance(size, int) or size < 0 or size > UPLOAD_MAX_BYTES):
+            return jsonify({'status': 'error', 'message': f'size must be between 0 and {UPLOAD_MAX_BYTES} bytes'}), 400
+        upload_id = create_upload(
+            _safe_filename(data.get('filename') or 'upload'),
+            data.get('mimeType') or 'application/octet-stream',
+            size,
+        )
+        return jsonify({'status': 'success', 'uploadId': upload_id, 'offset': 0,
+                        'chunkSize': UPLOAD_CHUNK_BYTES})
+    except Exception as e:
+        print(f"Initiate upload error: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    """Resume query: how many bytes of the upload the server has committed"""
+    try:
+        return jsonify({'status': 'success', **_upload_status(upload_id, load_upload(upload_id))})
+    except KeyError:
+        return jsonify({'status': 'error', 'message': 'Upload not found'}), 404
+    except Exception as e:
+        print(f"Get upload error: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/api/uploads/<upload_id>', methods=['PUT'])
+def append_upload(upload_id):
+    """Append the raw request body at ?offset=N (which must equal the committed offset)"""
+    try:
+        with _upload_lock(upload_id):
+            meta = load_upload(upload_id)
+            offset = request.args.get('offset', type=int)
+            if meta.get('link') or offset != meta['offset']:
+                # Stale or duplicate chunk: tell the client where to continue from.
+                return jsonify({'status': 'error', 'message': 'Offset mismatch',
+                                **_upload_status(upload_id, meta)}), 409
+
+            limit = meta['size'] if meta.get('size') is not None else UPLOAD_MAX_BYTES
+            _, part_path = _upload_paths(upload_id)
+            # Bytes are committed as they arrive, so a chunk cut off mid-way still counts
+            # up to where it stopped.
+            with open(part_path, 'ab') as f:
+                written = offset
+                for chunk in iter(lambda: request.stream.read(UPLOAD_HASH_CHUNK), b''):
+                    if written + len(chunk) > limit:
+                        f.truncate(offset)
+                        return jsonify({'status': 'error', 'message': f'Upload exceeds {limit} bytes'}), 413
+                    f.write(chunk)
+                    written += len(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            meta['offset'] = written
+            return jsonify({'status': 'success', **_upload_status(upload_id, meta)})
+    except KeyError:
+        return jsonify({'status': 'error', 'message': 'Upload not found'}), 404
+    except Exception as e:
+        print(f"Append upload error: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/api/uploads/<upload_id>/finalize', methods=['POST'])
+def finalize_upload_route(upload_id):
+    """Send the assembled file to Drive: {filename?} -> {link}"""
+    try:
+        meta = load_upload(upload_id)
+        if not meta.get('link') and meta.get('size') is not None and meta['offset'] != meta['size']:
+            return jsonify({'status': 'error', 'message': 'Upload is incomplete',
+                            **_upload_status(upload_id, meta)}), 409
+        data = request.get_json(silent=True) or {}
+        filename = _safe_filename(data['filename']) if data.get('filename') else None
+        return jsonify({'status': 'success', 'link': finalize_upload(upload_id, filename)})
+    except KeyError:
+        return jsonify({'status': 'error', 'message': 'Upload not found'}), 404
+    except Exception as e:
+        print(f"Finalize upload error: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
 # ==================== ASSESSMENTS ====================
 
 @app.route('/api/assessments/questions/<module_index>', methods=['GET'])
 def get_questions(module_index):
     """Get questions for a module (same as getTestSetupData in Code.gs)"""
     try:
-        sheet = get_sheet('Questions')
-        rows = sheet.get_all_values()
+        rows = sheet_cache.rows('Questions')
         
         questions = []
         for row in rows[1:]:
@@ -804,6 +3171,7 @@ def get_questions(module_index):
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/assessments/results', methods=['POST'])
+@idempotent
 def save_result():
     """Save assessment result with Google Drive upload (same as saveAssessmentResult in Code.gs)"""
     try:
@@ -811,13 +3179,23 @@ def save_result():
         trainee_id = data.get('traineeId')
         trainee_name = data.get('traineeName')
         module_num = data.get('moduleNum')
+
+        # Media arrives either inline as base64 ({data}) or as a finished resumable upload ({uploadId})
+        video = data.get('videoData') or {}
+        audio = data.get('audioData') or {}
+        for media in (video, audio):
+            if media.get('uploadId'):
+                try:
+                    load_upload(media['uploadId'])
+                except KeyError:
+                    return jsonify({'status': 'error', 'message': 'Upload not found or expired'}), 404
         
         # Get existing attempts
-        results_sheet = get_sheet('Results')
-        results_rows = results_sheet.get_all_values()
+        results_key = sheet_key(shard_for_trainee(trainee_id), 'Results')
+        results_sheet = get_sheet(results_key)
         
         attempts = 1
-        for row in results_rows[1:]:
+        for row in iter_partitioned_rows('Results', start=trainee_joined(trainee_id)):
             if len(row) >= 4 and row[1] == trainee_id and str(row[3]) == str(module_num):
                 attempts += 1
         
@@ -828,14 +3206,20 @@ def save_result():
         safe_name = _safe_filename(trainee_name or "trainee")
         safe_module = _safe_filename(str(module_num))
 
-        if data.get('videoData') and data['videoData'].get('data'):
+        if video.get('uploadId') or video.get('data'):
             video_filename = f"{safe_name}_M{safe_module}_Vid_{attempts}.webm"
-            video_link = upload_to_drive(data['videoData']['data'], video_filename, 'video/webm')
+            if video.get('uploadId'):
+                video_link = finalize_upload(video['uploadId'], video_filename)
+            else:
+                video_link = upload_to_drive(video['data'], video_filename, 'video/webm')
             print(f"Video uploaded: {video_link}")
 
-        if data.get('audioData') and data['audioData'].get('data'):
+        if audio.get('uploadId') or audio.get('data'):
             audio_filename = f"{safe_name}_M{safe_module}_Aud_{attempts}.webm"
-            audio_link = upload_to_drive(data['audioData']['data'], audio_filename, 'audio/webm')
+            if audio.get('uploadId'):
+                audio_link = finalize_upload(audio['uploadId'], audio_filename)
+            else:
+                audio_link = upload_to_drive(audio['data'], audio_filename, 'audio/webm')
             print(f"Audio uploaded: {audio_link}")
 
         # Add result to sheet
@@ -851,6 +3235,9 @@ def save_result():
             datetime.now().isoformat()
         ]
         results_sheet.append_row(result_row)
+        mark_table_changed(results_key)
+        publish_event('result.submitted', resultId=result_row[0], traineeId=trainee_id,
+                      traineeName=trainee_name, moduleNum=module_num, attempt=attempts)
         
         return jsonify({'status': 'success', 'attemptCount': attempts})
     except Exception as e:
@@ -860,54 +3247,114 @@ def save_result():
 # ==================== REVIEWS/GRADING ====================
 
 @app.route('/api/reviews/pending', methods=['GET'])
+@authenticated
 def get_pending_reviews():
     """Get pending reviews (same as getPendingReviews in Code.gs)"""
     try:
-        user_id = request.args.get('userId')
-        role = request.args.get('role')
-        
-        results_sheet = get_sheet('Results')
-        results_rows = results_sheet.get_all_values()
+        user_id, role = caller()
+        principal = g.principal
+        since = request.args.get('since')  # optional ISO date/datetime
+        since_ms = parse_timestamp_ms(since) if since else None
+        if since and since_ms is None:
+            return jsonify({'error': 'since must be an ISO date or datetime'}), 400
+        
+        def build():
+            # Trainers only need the shards their batches live on; Owners see every shard
+            shards = shard_ids()
+            if role == 'Trainer':
+                if principal is not None:
+                    my_batches, my_trainees = principal.batches, principal.trainees
+                else:
+                    my_batches = trainer_batches(user_id)
+                    my_trainees = trainees_in_batches(my_batches)
+                shards = sorted({shard_for_batch(code) for code in my_batches})
+        
+            # Ungraded results are never archived, so the hot sheets are all we need
+            if since_ms is not None:
+                results_rows = rows_between('Results', lo=since_ms, shards=shards)
+            else:
+                results_rows = [row for shard in shards for row in sheet_cache.rows(sheet_key(shard, 'Results'))[1:]]
+        
+            # Filter ungraded results (empty score)
+            pending = []
+            for row in results_rows:
+                if len(row) >= 9 and (len(row) < 8 or row[7] == '' or row[7] is None):
+                    pending.append(row)
+        
+            # If Trainer, filter by their batches
+            if role == 'Trainer':
+                pending = [r for r in pending if r[1] in my_trainees]
+        
+            reviews = []
+            for row in pending:
+                reviews.append({
+                    'resultId': row[0],
+                    'traineeName': row[2] if len(row) > 2 else '',
+                    'moduleNum': row[3] if len(row) > 3 else '',
+                    'videoLink': row[4] if len(row) > 4 else '',
+                    'audioLink': row[5] if len(row) > 5 else '',
+                    'attempt': row[6] if len(row) > 6 else 1,
+                    'date': row[8][:10] if len(row) > 8 and row[8] else ''
+                })
         
-        # Filter ungraded results (empty score)
-        pending = []
-        for row in results_rows[1:]:
-            if len(row) >= 9 and (len(row) < 8 or row[7] == '' or row[7] is None):
-                pending.append(row)
-        
-        # If Trainer, filter by their batches
-        if role == 'Trainer':
-            # Get trainer's batches
-            batch_sheet = get_sheet('Batches')
-            batch_rows = batch_sheet.get_all_values()
-            my_batches = [r[0] for r in batch_rows[1:] if len(r) >= 3 and r[2].strip() == user_id]
-            
-            # Get trainees in those batches
-            trainee_sheet = get_sheet('Trainees')
-            trainee_rows = trainee_sheet.get_all_values()
-            my_trainees = [r[0] for r in trainee_rows[1:] if len(r) >= 2 and r[1] in my_batches]
-            
-            # Filter pending results
-            pending = [r for r in pending if r[1] in my_trainees]
-        
-        reviews = []
-        for row in pending:
-            reviews.append({
-                'resultId': row[0],
-                'traineeName': row[2] if len(row) > 2 else '',
-                'moduleNum': row[3] if len(row) > 3 else '',
-                'videoLink': row[4] if len(row) > 4 else '',
-                'audioLink': row[5] if len(row) > 5 else '',
-                'attempt': row[6] if len(row) > 6 else 1,
-                'date': row[8][:10] if len(row) > 8 and row[8] else ''
-            })
+            return reviews
         
-        return jsonify(reviews)
+        key = ('pending', role, user_id, since_ms, cache_generations('Results', 'Batches', 'Trainees'))
+        return json_response(build, key)
     except Exception as e:
         print(f"Get pending reviews error: {e}")
         return jsonify({'error': str(e)}), 500
 
+def apply_grades(grades):
+    """Write (result_id, score) pairs to the Score column (H) of the Results sheets.
+
+    Each ID goes to the shard whose cached Results hold it; IDs no cache has seen yet are
+    tried on every shard. Returns {result_id: row number or None if unknown}.
+    """
+    keys = shard_keys('Results')
+    if len(keys) == 1:
+        return _apply_grades(keys[0], grades)
+    by_key = {}
+    for result_id, score in grades:
+        held = [key for key in keys if result_id in sheet_cache.index(key)]
+        for key in held or keys:
+            by_key.setdefault(key, []).append((result_id, score))
+    located = {result_id: None for result_id, _ in grades}
+    for found in fan_out(lambda key: _apply_grades(key, by_key[key]), by_key):
+        located.update({result_id: row for result_id, row in found.items() if row is not None})
+    return located
+
+def _apply_grades(key, grades):
+    """apply_grades() for one Results sheet.
+
+    Row numbers come from a single read of the Result ID column and all scores go out
+    in one batched values update. If an ID is given twice the last score wins.
+    """
+    sheet = get_sheet(key)
+    # Result ID + Trainee ID columns: enough to locate rows and address change events.
+    id_rows = sheet.get('A2:B')
+    row_of = {r[0]: (i, r[1] if len(r) > 1 else '') for i, r in enumerate(id_rows, start=2) if r and r[0]}
+
+    located = {}
+    updates = {}
+    for result_id, score in grades:
+        row, trainee_id = row_of.get(result_id, (None, None))
+        located[result_id] = row
+        if row is not None:
+            updates[row] = (result_id, trainee_id, score)
+
+    if updates:
+        sheet.batch_update(
+            [{'range': f'H{row}', 'values': [[score]]} for row, (_, _, score) in updates.items()],
+            value_input_option='USER_ENTERED',
+        )
+        mark_table_changed(key)
+        for result_id, trainee_id, score in updates.values():
+            publish_event('result.graded', resultId=result_id, traineeId=trainee_id, score=score)
+    return located
+
 @app.route('/api/reviews/grade', methods=['POST'])
+@idempotent
 def submit_grade():
     """Submit grade (same as submitGrade in Code.gs)"""
     try:
@@ -915,20 +3362,317 @@ def submit_grade():
         result_id = data.get('resultId')
         score = data.get('score')
         
-        sheet = get_sheet('Results')
-        rows = sheet.get_all_values()
-        
-        for i, row in enumerate(rows[1:], start=2):
-            if row[0] == result_id:
-                # Update score (column 8)
-                sheet.update_cell(i, 8, score)
-                return jsonify({'status': 'success'})
+        if apply_grades([(result_id, score)]).get(result_id):
+            return jsonify({'status': 'success'})
         
         return jsonify({'status': 'error', 'message': 'ID Not Found'})
     except Exception as e:
         print(f"Submit grade error: {e}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+@app.route('/api/reviews/grade/bulk', methods=['POST'])
+@idempotent
+def submit_grades_bulk():
+    """Grade many results at once: {"grades": [{"resultId": ..., "score": ...}, ...]}"""
+    try:
+        data = request.json or {}
+        grades = data.get('grades', [])
+        if not grades:
+            return jsonify({'status': 'error', 'message': 'No grades provided'}), 400
+        if not isinstance(grades, list):
+            return jsonify({'status': 'error', 'message': 'grades must be a list'}), 400
+
+        results = []
+        valid = []
+        for item in grades:
+            if not isinstance(item, dict):
+                results.append({'resultId': None, 'status': 'error', 'message': 'Each grade must be an object'})
+                continue
+            result_id = item.get('resultId')
+            score = item.get('score')
+            try:
+                if not result_id:
+                    raise ValueError('resultId is required')
+                float(score)
+            except (TypeError, ValueError) as e:
+                message = str(e) if not result_id else 'Invalid score'
+                results.append({'resultId': result_id, 'status': 'error', 'message': message})
+                continue
+            valid.append((result_id, score))
+            results.append({'resultId': result_id, 'status': None})
+
+        located = apply_grades(valid) if valid else {}
+        for r in results:
+            if r['status'] is None:
+                found = located.get(r['resultId'])
+                r['status'] = 'success' if found else 'error'
+                if not found:
+                    r['message'] = 'ID Not Found'
+
+        updated = sum(1 for r in results if r['status'] == 'success')
+        return jsonify({'status': 'success', 'updated': updated, 'results': results})
+    except Exception as e:
+        print(f"Bulk grade error: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+# ==================== EVENTS ====================
+
+def _sse(event):
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+@app.route('/api/events', methods=['GET'])
+@authenticated
+def stream_events():
+    """Server-Sent Events stream of changes.
+
+    Owners get everything; Trainers (?userId=X&role=Trainer) only events for their batches
+    and trainees; ?batchCode= narrows to one batch. Reconnecting clients send Last-Event-ID
+    and get the retained events they missed. EventSource can't set headers, so the session
+    token goes in ?token=.
+    """
+    try:
+        user_id, role = caller()
+        batch_code = request.args.get('batchCode')
+
+        trainer_id = user_id if role == 'Trainer' else None
+        if trainer_id and not batch_code and g.principal is not None:
+            # The session already holds the scope (the subscriber extends its own copies)
+            subscriber = _Subscriber(trainer_id, set(g.principal.batches), set(g.principal.trainees))
+        elif trainer_id or batch_code:
+            batches = trainer_batches(trainer_id) if trainer_id else {batch_code}
+            if trainer_id and batch_code:
+                batches &= {batch_code}
+                trainer_id = None  # pinned to one batch: don't follow new batches
+            subscriber = _Subscriber(trainer_id, batches, trainees_in_batches(batches))
+        else:
+            subscriber = _Subscriber()
+
+        last_id = request.headers.get('Last-Event-ID') or request.args.get('lastEventId')
+        if event_bus.subscribe(subscriber, int(last_id) if last_id and last_id.isdigit() else None) is None:
+            response = jsonify({'status': 'error', 'message': 'Too many open event streams, retry later'})
+            response.headers['Retry-After'] = '30'
+            return response, 503
+    except Exception as e:
+        print(f"Event stream error: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+    def generate():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                if subscriber.overflowed:
+                    yield "event: resync\ndata: {}\n\n"
+                    break
+                try:
+                    event = subscriber.queue.get(timeout=EVENT_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield _sse(event)
+        finally:
+            event_bus.unsubscribe(subscriber)
+
+    # No stream_with_context: the generator never touches `request`, and long-lived
+    # connections shouldn't pin a request context.
+    return Response(
+        generate(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+# ==================== REPORTS ====================
+
+def _pass_score_arg():
+    value = request.args.get('passScore')
+    return float(value) if value not in (None, '') else PASS_SCORE
+
+def _attendance_trend(batch_code, start=None, end=None):
+    days = []
+    for day in attendance_store.batch_report(batch_code, start, end)['daily']:
+        days.append({
+            'date': day['date'],
+            'present': day['present'],
+            'total': day['total'],
+            'rate': round(day['present'] / day['total'] * 100) if day['total'] else 0,
+        })
+    return days
+
+@app.route('/api/reports/batches', methods=['GET'])
+def report_batches():
+    """Per-batch score, pass, completion and attendance aggregates"""
+    try:
+        rates = attendance_store.batch_rates()
+        report = []
+        for row in report_engine.batches(_pass_score_arg()):
+            present, total = rates.get(row['batchCode'], (0, 0))
+            report.append({**row, 'attendanceRate': round(present / total * 100) if total else None})
+        return jsonify(report)
+    except Exception as e:
+        print(f"Batch report error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/reports/modules', methods=['GET'])
+def report_modules():
+    """Per-module score distribution, pass and completion rates (optionally for one batch)"""
+    try:
+        batch_code = request.args.get('batchCode') or None
+        return jsonify(report_engine.modules(batch_code, _pass_score_arg()))
+    except Exception as e:
+        print(f"Module report error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/reports/trainers', methods=['GET'])
+def report_trainers():
+    """Per-trainer grading and pass-rate aggregates"""
+    try:
+        return jsonify(report_engine.trainers(_pass_score_arg()))
+    except Exception as e:
+        print(f"Trainer report error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/reports/attendance', methods=['GET'])
+def report_attendance():
+    """Daily attendance rate per batch (all batches unless ?batchCode= is given)"""
+    try:
+        start, end = request.args.get('from'), request.args.get('to')
+        batch_code = request.args.get('batchCode')
+        codes = [batch_code] if batch_code else attendance_store.batch_codes()
+        return jsonify([
+            {'batchCode': code, 'days': _attendance_trend(code, start, end)}
+            for code in codes
+        ])
+    except Exception as e:
+        print(f"Attendance report error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+# ==================== EXPORTS ====================
+
+# Rows fetched per Sheets API call while streaming an export.
+EXPORT_CHUNK_ROWS = int(os.environ.get("EXPORT_CHUNK_ROWS", "1000"))
+
+# table -> (sheet, batch column, date column); Results has no batch column and is
+# filtered through the trainee -> batch mapping instead.
+EXPORT_TABLES = {
+    'results': ('Results', None, 8),
+    'attendance': ('Attendance', 1, 3),
+    'trainees': ('Trainees', 1, 5),
+}
+
+
+def iter_sheet_rows(sheet, chunk_rows=None, start_row=2):
+    """Yield data rows from `start_row` on (default: after the header), `chunk_rows` at a time.
+
+    Stops at the first chunk with no values at all, so the blank rows Sheets keeps below
+    the data are not fetched (worksheet handles are cached, so row_count may be stale).
+    """
+    chunk_rows = chunk_rows or EXPORT_CHUNK_ROWS
+    last_col = _col_letter(len(SHEET_STRUCTURE.get(base_sheet(sheet.title), [])) or 26)
+    start = start_row
+    while True:
+        end = start + chunk_rows - 1
+        chunk = sheet.get(f"A{start}:{last_col}{end}")
+        if not chunk:
+            break
+        for row in chunk:
+            if any(row):
+                yield row
+        start = end + 1
+
+
+class _LineBuffer:
+    """File-like target for csv.writer that hands back each written line."""
+
+    def write(self, value):
+        return value
+
+
+def _export_filters(sheet_name, batch_col):
+    """Resolve ?batchCode / ?trainerId into the set of batch codes (or trainee IDs for Results)."""
+    batch_code = request.args.get('batchCode')
+    trainer_id = request.args.get('trainerId')
+    if not batch_code and not trainer_id:
+        return None
+
+    batches = {batch_code} if batch_code else None
+    if trainer_id:
+        mine = trainer_batches(trainer_id)
+        batches = mine if batches is None else batches & mine
+
+    if batch_col is not None:
+        return batches
+    # Results only carry the trainee ID
+    return trainees_in_batches(batches)
+
+
+@app.route('/api/export/<table>', methods=['GET'])
+def export_table(table):
+    """Stream Results/Attendance/Trainees as CSV or NDJSON.
+
+    Query: format=csv|ndjson, batchCode, trainerId, from/to (YYYY-MM-DD, inclusive).
+    Archived quarters outside from/to are not read at all.
+    """
+    try:
+        if table.lower() not in EXPORT_TABLES:
+            return jsonify({'status': 'error', 'message': f'Unknown export table: {table}'}), 404
+        sheet_name, batch_col, date_col = EXPORT_TABLES[table.lower()]
+        fmt = request.args.get('format', 'csv').lower()
+        if fmt not in ('csv', 'ndjson'):
+            return jsonify({'status': 'error', 'message': 'format must be csv or ndjson'}), 400
+
+        start, end = request.args.get('from'), request.args.get('to')
+        allowed = _export_filters(sheet_name, batch_col)
+        key_col = batch_col if batch_col is not None else 1
+        headers = SHEET_STRUCTURE[sheet_name]
+        # (worksheet, first row to read): archives, then each shard's hot sheet
+        sheets = []
+        if sheet_name in PARTITIONED_SHEETS:
+            sheets = [(get_sheet(p.key), 2) for p in list_partitions(sheet_name, start, end)]
+        # Results are in creation order, so ?from can skip straight to the first row on or after
+        # it. Only when the sheet is already cached: loading it just to seek costs more than the
+        # rows skipped (matches() drops them anyway).
+        from_ms = parse_timestamp_ms(start) if sheet_name == 'Results' and start else None
+        for shard in shard_ids():
+            key = sheet_key(shard, sheet_name)
+            start_row = 2
+            if from_ms is not None and sheet_cache.holds(key):
+                start_row = row_index('Results', shard).seek(from_ms)
+            sheets.append((get_sheet(key), start_row))
+    except Exception as e:
+        print(f"Export error: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+    def matches(row):
+        if allowed is not None and (len(row) <= key_col or row[key_col] not in allowed):
+            return False
+        if start or end:
+            day = row[date_col][:10] if len(row) > date_col else ''
+            if (start and day < start) or (end and day > end):
+                return False
+        return True
+
+    def generate():
+        rows = itertools.chain.from_iterable(
+            iter_sheet_rows(sheet, start_row=start_row) for sheet, start_row in sheets
+        )
+        if fmt == 'csv':
+            writer = csv.writer(_LineBuffer())
+            yield writer.writerow(headers)
+            for row in rows:
+                if matches(row):
+                    yield writer.writerow(row + [''] * (len(headers) - len(row)))
+        else:
+            for row in rows:
+                if matches(row):
+                    yield json.dumps(dict(zip(headers, row)), ensure_ascii=False) + '\n'
+
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    filename = f"{table.lower()}.{fmt}"
+    return Response(
+        stream_with_context(generate()),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'},
+    )
+
 # ==================== STATIC FILES ====================
 
 @app.route('/uploads/<filename>')
@@ -953,6 +3697,8 @@ def health_check():
 @app.route('/api/drive/diagnostics', methods=['GET'])
 def drive_diagnostics():
     """Validate Drive credentials + upload folder access."""
+    from google.oauth2.service_account import Credentials
+
     try:
         base_dir = os.path.dirname(os.path.abspath(__file__))
         creds_path = os.path.join(base_dir, 'credentials.json')
@@ -973,17 +3719,96 @@ def drive_diagnostics():
         print(f"Drive diagnostics error: {e}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+# ==================== MAINTENANCE ====================
+
+@app.cli.command('archive')
+@click.option('--days', type=int, default=ARCHIVE_AFTER_DAYS, show_default=True,
+              help='Archive rows dated more than this many days ago.')
+@click.option('--dry-run', is_flag=True, help='Only report what would be moved.')
+def archive_command(days, dry_run):
+    """Move old Results/Attendance rows into quarterly archive sheets (on every shard)."""
+    for shard in shard_ids():
+        for sheet_name in PARTITIONED_SHEETS:
+            label = sheet_key(shard, sheet_name)
+            moved = archive_sheet(sheet_name, days, dry_run, shard)
+            if not moved:
+                click.echo(f"{label}: nothing older than {days} days")
+            for title, count in sorted(moved.items()):
+                click.echo(f"{label}: {count} rows -> {title}{' (dry run)' if dry_run else ''}")
+
+@app.cli.command('backfill-order')
+@click.option('--format', 'fmt', required=True,
+              help="strptime format of the legacy Timestamp cells, e.g. '%d/%m/%Y %H:%M:%S'.")
+@click.option('--dry-run', is_flag=True, help='Only count the rows that would be updated.')
+def backfill_order_command(fmt, dry_run):
+    """Convert legacy Timestamp cells in FORMAT to ISO so old rows sort by time.
+
+    Empty cells are never filled in. Every sheet is checked before anything is written,
+    so a format that doesn't fit, or puts rows out of order, changes nothing.
+    """
+    targets = [(shard, sheet_name) for shard in shard_ids() for sheet_name in ROW_TIMESTAMP_COLUMNS]
+    try:
+        for shard, sheet_name in targets:
+            backfill_timestamps(sheet_name, fmt, True, shard)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    for shard, sheet_name in targets:
+        count, empty = backfill_timestamps(sheet_name, fmt, dry_run, shard)
+        click.echo(f"{sheet_key(shard, sheet_name)}: {count} timestamps "
+                   f"{'to rewrite' if dry_run else 'rewritten'}, {empty} empty")
+
+@app.cli.command('shard-status')
+def shard_status_command():
+    """Show each shard's spreadsheet and how many batches it holds."""
+    for shard, codes in shard_batches().items():
+        click.echo(f"{shard}: {len(codes)} batches ({SHARD_SPREADSHEETS[shard]})")
+
+@app.cli.command('shard-move')
+@click.argument('batch_code')
+@click.argument('shard')
+@click.option('--dry-run', is_flag=True, help='Only count the rows that would be moved.')
+def shard_move_command(batch_code, shard, dry_run):
+    """Move one batch (trainees, attendance, results) to SHARD."""
+    moved = move_batch(batch_code, shard, dry_run)
+    if not moved:
+        click.echo(f"{batch_code} is already on {shard}")
+    for sheet_name, count in moved.items():
+        click.echo(f"{batch_code}: {count} {sheet_name} rows -> {shard}{' (dry run)' if dry_run else ''}")
+
+@app.cli.command('shard-rebalance')
+@click.option('--dry-run', is_flag=True, help='Only list the moves.')
+def shard_rebalance_command(dry_run):
+    """Move batches until every shard holds about the same number (with SHARD_BY=trainer:
+    until every trainer's batches are on their trainer's shard).
+
+    Also the migration path: after adding spreadsheets to SHARD_SPREADSHEETS, this moves
+    existing batches off main onto them.
+    """
+    moves = plan_rebalance()
+    if not moves:
+        click.echo("Shards are balanced")
+    for batch_code, source, target in moves:
+        click.echo(f"{batch_code}: {source} -> {target}{' (dry run)' if dry_run else ''}")
+        if not dry_run:
+            move_batch(batch_code, target)
+
 if __name__ == '__main__':
     print("=" * 60)
     print("Einstein360 LMS Backend")
     print("=" * 60)
     print(f"Spreadsheet ID: {SPREADSHEET_ID}")
+    if not app.secret_key:
+        print("SECRET_KEY not set: session tokens will stop verifying after a restart"
+              + (" and REQUIRE_SESSION_TOKENS logins will fail" if REQUIRE_SESSION_TOKENS else ""))
     print("")
     
     try:
         print("Connecting to Google Sheets...")
-        check_database()
-        print("Connected successfully!")
+        for shard in shard_ids():
+            check_database(shard)
+        print(f"Connected successfully! ({len(SHARD_SPREADSHEETS)} spreadsheet(s))")
+        sheet_cache.warm([key for name in ('Users', 'Batches', 'Trainees', 'Results', 'Attendance')
+                          for key in shard_keys(name)])
     except Exception as e:
         print(f"Could not connect to Google Sheets: {e}")
         print("")
@@ -1,5 +1,5 @@
 import React, { useState, useEffect, useRef } from 'react';
-import { getTestSetupData, saveAssessmentResult } from '@/services/api';
+import { getTestSetupData, saveAssessmentResult, uploadResumable } from '@/services/api';
 import { toast } from 'sonner';
 
 interface AssessmentProps {
@@ -159,16 +159,18 @@ const Assessment: React.FC<AssessmentProps> = ({
         videoBlob = await cameraPromise;
       }
 
-      // Convert blobs to base64
-      const audioBase64 = await blobToBase64(audioBlob);
-      const videoBase64 = videoBlob ? await blobToBase64(videoBlob) : null;
+      // Upload in resumable chunks, then save the result referencing the uploads
+      const audioUploadId = await uploadResumable(audioBlob, `${traineeName}_M${moduleNum}_Aud.webm`);
+      const videoUploadId = videoBlob
+        ? await uploadResumable(videoBlob, `${traineeName}_M${moduleNum}_Vid.webm`)
+        : null;
 
       await saveAssessmentResult(
         traineeId,
         traineeName,
         moduleNum,
-        videoBase64 ? { data: videoBase64 } : null,
-        { data: audioBase64 }
+        videoUploadId ? { uploadId: videoUploadId } : null,
+        audioUploadId ? { uploadId: audioUploadId } : null
       );
 
       toast.success('Assessment submitted successfully!');
@@ -181,18 +183,6 @@ const Assessment: React.FC<AssessmentProps> = ({
     }
   };
 
-  const blobToBase64 = (blob: Blob): Promise<string> => {
-    return new Promise((resolve, reject) => {
-      const reader = new FileReader();
-      reader.readAsDataURL(blob);
-      reader.onloadend = () => {
-        const base64 = (reader.result as string).split(',')[1];
-        resolve(base64);
-      };
-      reader.onerror = reject;
-    });
-  };
-
   const handleExit = () => {
     stopAllStreams();
     onClose();
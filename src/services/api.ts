@@ -13,14 +13,25 @@ import type {
 
 const BASE_URL = '/api'; // Uses Vite dev-server proxy in local dev
 
+// Session token issued at login, stored with the user by AuthContext
+function authHeaders(): Record<string, string> {
+  try {
+    const token = JSON.parse(localStorage.getItem('lms_user') || 'null')?.token;
+    return token ? { Authorization: `Bearer ${token}` } : {};
+  } catch {
+    return {};
+  }
+}
+
 async function request<T>(endpoint: string, options?: RequestInit): Promise<T> {
   const response = await fetch(`${BASE_URL}${endpoint}`, {
+    ...options,
     headers: {
       Accept: 'application/json',
       'Content-Type': 'application/json',
+      ...authHeaders(),
       ...options?.headers,
     },
-    ...options,
   });
 
   const raw = await response.text();
@@ -32,6 +43,12 @@ async function request<T>(endpoint: string, options?: RequestInit): Promise<T> {
     }
   })() : null;
 
+  if (response.status === 401 && localStorage.getItem('lms_user')) {
+    // Session no longer valid: drop the stored user and go back to the login screen
+    localStorage.removeItem('lms_user');
+    window.location.assign('/');
+  }
+
   if (!response.ok) {
     const message =
       (typeof data === 'object' && data && ('message' in data || 'error' in data))
@@ -150,17 +167,59 @@ export const saveAttendance = (data: {
 export const getTestSetupData = (moduleIndex: string): Promise<{ questions: Array<{ question: string }> }> =>
   request(`/assessments/questions/${moduleIndex}`);
 
-export const saveAssessmentResult = (
+// Resumable upload: sends the blob in chunks and, when a chunk fails, asks the server how
+// much it already has and continues from there. Returns the uploadId for saveAssessmentResult,
+// or null for an empty blob (nothing recorded), which the backend stores as 'Skipped'.
+export const uploadResumable = async (blob: Blob, filename: string, retries = 5): Promise<string | null> => {
+  if (blob.size === 0) return null;
+  const { uploadId, chunkSize } = await request<{ uploadId: string; chunkSize: number }>('/uploads', {
+    method: 'POST',
+    body: JSON.stringify({ filename, mimeType: blob.type, size: blob.size }),
+  });
+  let offset = 0;
+  let failures = 0;
+  while (offset < blob.size) {
+    try {
+      const status = await request<{ offset: number }>(`/uploads/${uploadId}?offset=${offset}`, {
+        method: 'PUT',
+        headers: { 'Content-Type': 'application/octet-stream' },
+        body: blob.slice(offset, offset + chunkSize),
+      });
+      offset = status.offset;
+    } catch (error) {
+      if (++failures > retries) throw error;
+      offset = (await request<{ offset: number }>(`/uploads/${uploadId}`)).offset;
+    }
+  }
+  return uploadId;
+};
+
+type MediaPayload = { data: string } | { uploadId: string } | null;
+
+// Retries reuse the same Idempotency-Key, so a submission whose response was lost
+// (timeout, dropped Wi-Fi) is not saved or uploaded twice.
+export const saveAssessmentResult = async (
   traineeId: string,
   traineeName: string,
   moduleNum: string,
-  videoData: { data: string } | null,
-  audioData: { data: string } | null
-): Promise<{ status: string; attemptCount: number }> =>
-  request('/assessments/results', {
+  videoData: MediaPayload,
+  audioData: MediaPayload,
+  retries = 2
+): Promise<{ status: string; attemptCount: number }> => {
+  const options: RequestInit = {
     method: 'POST',
+    headers: { 'Idempotency-Key': crypto.randomUUID() },
     body: JSON.stringify({ traineeId, traineeName, moduleNum, videoData, audioData }),
-  });
+  };
+  for (let attempt = 0; ; attempt++) {
+    try {
+      return await request('/assessments/results', options);
+    } catch (error) {
+      // fetch() rejects with a TypeError when the network fails; HTTP errors are final.
+      if (!(error instanceof TypeError) || attempt >= retries) throw error;
+    }
+  }
+};
 
 // Reviews/Grading
 export const getPendingReviews = (userId: string, role: string): Promise<PendingReview[]> =>
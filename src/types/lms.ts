@@ -5,6 +5,7 @@ export interface User {
   name: string;
   email: string;
   role: 'Owner' | 'Trainer' | 'Trainee';
+  token?: string; // signed session token from login/register/setup
 }
 
 export interface Batch {